@@ -0,0 +1,64 @@
+"""
+Times single combinators on short inputs: p_regex with its pattern
+compiled once, as the parser does, against compiling it on every match as
+it used to, and strip around a match, e.g.
+
+    python -m benchmarks.combinators --number 200000
+"""
+import argparse
+import re
+import sys
+import timeit
+
+from matcha.parsing.base import Combinator, Source, match, p_regex, strip
+
+PATTERNS = {
+    'symbol': ('[a-zA-Z_][a-zA-Z0-9_]*', 'name_1 + 2'),
+    'numeric': ('[0-9]+(\\.[0-9]+)?', '3.14 + x'),
+    }
+
+
+def p_regex_uncompiled(regex):
+    def regex_parser(source, pos):
+        m = re.compile(regex).match(source.text, pos)
+        if m:
+            return m.group(), m.end()
+
+        return None
+
+    return Combinator(regex_parser)
+
+
+def cases():
+    for name, (regex, text) in sorted(PATTERNS.items()):
+        yield name, p_regex(regex), p_regex_uncompiled(regex), text
+
+    yield 'strip', strip(match('x')), None, '  x  '
+
+
+def best(parser, text, number, repeat):
+    source = Source(text)
+    parse = parser.parse
+    return min(timeit.repeat(
+        lambda: parse(source, 0), number=number, repeat=repeat))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--number', type=int, default=200000,
+        help='calls per run (default: 200000)')
+    parser.add_argument('--repeat', type=int, default=5,
+        help='runs per combinator, the fastest is reported (default: 5)')
+    args = parser.parse_args(args)
+
+    for name, compiled, uncompiled, text in cases():
+        line = '%-8s %.3fs' % (name, best(
+            compiled, text, args.number, args.repeat))
+        if uncompiled:
+            line += '  (uncompiled %.3fs)' % best(
+                uncompiled, text, args.number, args.repeat)
+        print(line)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,80 @@
+"""
+Synthetic .tea programs for the benchmarks. Every shape takes a size, the
+number of units it repeats, and returns source text that parses, infers
+and compiles with both backends.
+"""
+
+def functions(size):
+    out = ['import sys', '']
+    for i in range(size):
+        out += [
+            'def f%d(x):' % i,
+            '    if x < 2:',
+            '        return 1',
+            '    y = 3',
+            '    return f%d(x - 1) + f%d(x - 2)' % (i, i),
+            '']
+
+    out += ['sys.log(f%d(%d))' % (i, i % 10) for i in range(size)]
+    return '\n'.join(out) + '\n'
+
+
+def nesting(size, depth=16):
+    out = ['import sys', '']
+    for i in range(size):
+        out.append('def g%d(x):' % i)
+        for d in range(1, depth + 1):
+            out.append('    ' * d + 'if x > %d:' % d)
+            out.append('    ' * (d + 1) + 'y = %d' % d)
+        out.append('    ' * (depth + 1) + 'return x')
+        out.append('    return x + 1')
+        out.append('')
+
+    out += ['sys.log(g%d(%d))' % (i, i) for i in range(size)]
+    return '\n'.join(out) + '\n'
+
+
+def expressions(size, length=50):
+    operators = ['+', '-', '*', '/']
+    out = ['import sys', '']
+    for i in range(size):
+        terms = ['x']
+        for t in range(1, length):
+            terms.append(operators[(i + t) % 4])
+            terms.append(str(t) if t % 3 else '(x + %d)' % t)
+        # inference reads the argument type from the outermost operator
+        terms += ['+', '1']
+        out += ['def e%d(x):' % i, '    return ' + ' '.join(terms), '']
+
+    out += ['sys.log(e%d(%d))' % (i, i) for i in range(size)]
+    return '\n'.join(out) + '\n'
+
+
+def lists(size, length=200):
+    out = ['import sys', '']
+    for i in range(size):
+        items = ','.join(str(i + n) for n in range(length))
+        out += ['def l%d():' % i, '    return [%s]' % items, '']
+
+    out += ['sys.log(l%d())' % i for i in range(size)]
+    return '\n'.join(out) + '\n'
+
+
+def imports(size):
+    out = ['import m%d' % i for i in range(size)]
+    out += ['import sys', '']
+    out += ['sys.log(m%d.value())' % i for i in range(size)]
+    return '\n'.join(out) + '\n'
+
+
+SHAPES = {
+    'functions': functions,
+    'nesting': nesting,
+    'expressions': expressions,
+    'lists': lists,
+    'imports': imports
+    }
+
+
+def generate(shape, size):
+    return SHAPES[shape](size)
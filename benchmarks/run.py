@@ -0,0 +1,90 @@
+"""
+Times the compiler phases on synthetic programs and writes the results as
+JSON, e.g.
+
+    python -m benchmarks.run --size 100 --output bench_output.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from matcha.ast.inference import Inference
+from matcha.java import generate_program as generate_java
+from matcha.js import generate as generate_js
+from matcha.parsing import Source, grammar
+
+from . import corpus
+
+
+def parse(text):
+    result = grammar().parse(Source(text, lexed=True))
+    if not result or result[1]:
+        raise RuntimeError('benchmark program did not parse')
+    return result[0]
+
+
+def best(repeat, f, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f(*args)
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def measure(shape, size, repeat):
+    text = corpus.generate(shape, size)
+    parse_time, ast = best(repeat, parse, text)
+    infer_time, types = best(repeat, Inference, ast)
+    js_time, _ = best(repeat, generate_js, ast, types)
+    java_time, _ = best(repeat, generate_java, ast, types)
+
+    return {
+        'shape': shape,
+        'size': size,
+        'lines': text.count('\n'),
+        'bytes': len(text),
+        'parse': parse_time,
+        'infer': infer_time,
+        'js': js_time,
+        'java': java_time
+        }
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--shape', action='append',
+        choices=sorted(corpus.SHAPES),
+        help='shape of program to generate, may be repeated (default: all)')
+    parser.add_argument('--size', type=int, action='append',
+        help='number of units per program, may be repeated (default: 100)')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='runs per phase, the fastest is reported (default: 3)')
+    parser.add_argument('--output', help='file to write (default: stdout)')
+    args = parser.parse_args(args)
+
+    sys.setrecursionlimit(10000)
+    results = []
+    for shape in args.shape or sorted(corpus.SHAPES):
+        for size in args.size or [100]:
+            results.append(measure(shape, size, args.repeat))
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+        }
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,124 +1,205 @@
+import io
 import sys
 import logging
 import os
+import time
 
-from matcha.ast import get_imports
-from matcha.parsing import program
-from matcha.js import generate as generate_js
-from matcha.java import bootstrap_imports
-from matcha.java import generate_program as generate_java
-
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger()
 
-def parse(text):
-    result = program()(text)
-    if not result:
-        log.critical('failed parsing')
-        return
+def watch(filename, language, jobs, packrat, cache, optimize=False,
+          interval=0.5):
+    """
+    Writes the linked program to Program.<language> and rebuilds it every
+    time the program or a module it imports changes. Only modules whose
+    content changed are compiled again, code generation does not depend on
+    imported modules so the modules importing them are only linked again.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from matcha.build import (
+        ModuleGraph, build, changed, compile_source, write_if_changed)
+
+    executor = ProcessPoolExecutor(jobs) if jobs > 1 else None
+    graph = ModuleGraph(language, jobs, packrat, executor, optimize=optimize)
+    parent_path = os.path.dirname(filename)
+    output_filename = 'Program.%s' % language
+    stamps = {}
+    ast = output = None
+
+    while True:
+        files = [filename] + [m.filename for m in graph.modules.values()]
+        modified = changed(files, stamps)
+        if modified:
+            start = time.perf_counter()
+            names = [m.name for m in graph.modules.values()
+                     if m.filename in modified]
+            relinked = graph.importers(names) - set(names)
+            graph.discard(names)
+
+            if filename in modified:
+                ast, output = compile_source(
+                    stamps[filename][1], 'Program', language, is_main=True,
+                    cache=cache, packrat=packrat, optimize=optimize)
+
+            linked = io.StringIO()
+            try:
+                ok = ast and build(
+                    linked, graph, ast, output, parent_path, language)
+            except RuntimeError as e:
+                log.error(e)
+                ok = False
+
+            if ok:
+                write_if_changed(output_filename, linked.getvalue())
+
+            # modules found by this build are up to date
+            changed([m.filename for m in graph.modules.values()], stamps)
+
+            log.info('%s %s in %.1f ms (changed: %s, relinked: %s)',
+                     'rebuilt' if ok else 'failed building', output_filename,
+                     (time.perf_counter() - start) * 1000,
+                     ', '.join(modified),
+                     ', '.join(sorted(relinked)) or 'none')
+
+        time.sleep(interval)
+
+def serve(args):
+    from matcha import server
+
+    jobs = 1
+    if '--jobs' in args:
+        jobs = int(args[args.index('--jobs') + 1])
+
+    path = None
+    if '--socket' in args:
+        path = args[args.index('--socket') + 1]
+
+    server.serve(jobs, path)
+
+def compile_remote(path, language, filename, optimize):
+    """
+    Compiles through the compile server at path, returns False when no
+    server is listening there.
+    """
+    from matcha import client
+
+    job = client.compile_job(language, filename, optimize)
+    try:
+        reply = client.request(path, job)
+    except (FileNotFoundError, ConnectionRefusedError):
+        log.warning('no compile server at %s, compiling here', path)
+        if 'source' in job:
+            sys.stdin = io.StringIO(job['source'])
+        return False
+
+    if 'error' in reply:
+        log.critical(reply['error'])
+        sys.exit(1)
 
-    ast, rest = result
-    if rest:
-        log.critical('failed parsing, leftover: %s', rest)
-        log.critical(ast)
-        return
+    sys.stdout.write(reply['output'])
+    return True
 
-    return ast
+def profile(filename, memory=False):
+    """
+    Profiles the compile and writes the profile to filename when the
+    program exits, as JSON for .json files and as folded stacks for flame
+    graphs otherwise.
+    """
+    import atexit
+    from matcha import profiling
 
+    def write():
+        with open(filename, 'w') as f:
+            profiling.stop().dump(
+                f, 'json' if filename.endswith('.json') else 'folded')
 
-def std_lookup(module_name, language):
-    possible = [
-        '%s.%s' % (module_name, 'tea'),
-        '%s.%s' % (module_name, language)]
+    profiling.start(profiling.Profile(memory))
+    atexit.register(write)
 
-    std_path = os.getenv('MATCHA_LIB', 'matcha/std')
-    return [os.path.join(std_path, p)
-            for p in possible]
+def main(args):
+    if args[0] == 'serve':
+        serve(args[1:])
+        return
 
+    packrat = '--packrat' in args
+    optimize = '--optimize' in args
+    jobs = 1
+    if '--jobs' in args:
+        jobs = int(args[args.index('--jobs') + 1])
 
-def module_lookup(module_name, parent_path, language):
-    for filename in std_lookup(module_name, language):
-        if os.path.exists(filename):
-            return filename, True
+    language = args[-2]
 
-    possible = (
-        parent_path,
-        os.getcwd())
+    server = os.getenv('MATCHA_SERVER')
+    if '--server' in args:
+        server = args[args.index('--server') + 1]
 
-    possible = [os.path.join(
-        p, '%s.%s' % (module_name, 'tea'))
-        for p in possible]
+    local_only = {'--ast', '--packrat', '--watch', '--source-map', '--profile'}
+    if server and not local_only.intersection(args):
+        if compile_remote(server, language, args[-1], optimize):
+            return
 
-    for filename in possible:
-        if os.path.exists(filename):
-            return filename, False
+    from matcha.build import ModuleGraph, build, compile_source, parse
+    from matcha.cache import open_cache
 
-    return None, False
+    if '--profile' in args:
+        profile(args[args.index('--profile') + 1], '--profile-memory' in args)
+        # phases run in worker processes would not be recorded
+        jobs = 1
 
-def should_compile(source):
-    return source.endswith('.tea')
+    cache = open_cache()
 
+    source_map = None
+    if '--source-map' in args:
+        source_map = args[args.index('--source-map') + 1]
+        if language != 'js':
+            print('source maps are only generated for js')
+            sys.exit(1)
 
-def compile_module(out, module_name, ast, language, is_main=False):
-    if language == 'js':
-        out.write(generate_js(ast))
-    elif language == 'java':
-        out.write(bootstrap_imports())
-        out.write('public class %s {' % module_name)
-        if is_main:
-            out.write('public static void main(String[] args) { matcha_main(); }')
-        out.write(generate_java(ast))
-        out.write('}')
-    else:
-        raise RuntimeError('Unknown backend: %s' % language)
+        from matcha.js import sourcemap
 
-def link_module(filename, module_name, language, is_std=False):
-    if language == 'java':
-        if is_std:
-            sys.stdout.write('import matcha.std.%s;' % module_name)
-    else:
-        sys.stdout.write('var %s = (function(){' % module_name);
-        sys.stdout.write(open(filename).read())
-        sys.stdout.write('return exports;})();')
+    if '--watch' in args:
+        watch(args[-1], language, jobs, packrat, cache, optimize)
+        return
 
-def main(args):
     if args[-1] == '-':
-        ast = parse(sys.stdin.read())
+        text = sys.stdin.read()
     else:
-        ast = parse(open(args[-1]).read())
+        text = open(args[-1]).read()
+
+    mappings = [] if source_map else None
+    if cache or source_map:
+        ast, output = compile_source(
+            text, 'Program', language, is_main=True, cache=cache,
+            packrat=packrat, mappings=mappings, optimize=optimize)
+    else:
+        # nothing needs the program's code whole, build streams it out
+        ast, _ = parse(text, packrat)
+        output = None
+    if not ast:
+        sys.exit(1)
 
     if args[0] == '--ast':
         print(ast)
 
-    language = args[-2]
-
-    imports = get_imports(ast.body)
-    for import_ in imports:
-        module_name = import_.name
-        filename, is_std = module_lookup(
-            module_name,
-            os.path.dirname(args[-1]),
-            language)
-
-        if not filename:
-            raise RuntimeError('could not find module: %s' % module_name)
-
-        if should_compile(filename):
-            module_ast = parse(open(filename).read())
-
-            output_filename = '%s.%s' % (module_name, language)
-            with open(output_filename, 'w') as out:
-                compile_module(out, module_name, module_ast, language)
-
-            link_module(output_filename, module_name, language)
-        else:
-            link_module(filename, module_name, language, is_std=True)
+    out = sourcemap.Writer(sys.stdout) if source_map else sys.stdout
+    graph = ModuleGraph(language, jobs, packrat, source_map=bool(source_map),
+                        optimize=optimize)
+    if not build(out, graph, ast, output, os.path.dirname(args[-1]),
+                 language, args[-1], mappings):
+        sys.exit(1)
 
-    compile_module(sys.stdout, 'Program', ast, language, is_main=True)
+    if source_map:
+        out.write('\n//# sourceMappingURL=%s\n' % source_map)
+        with open(source_map, 'w') as f:
+            f.write(sourcemap.dumps(out))
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     if len(sys.argv) < 2:
-        print('usage: main.py [ --ast ] <input>')
+        print('usage: main.py [ --ast ] [ --packrat ] [ --optimize ] '
+              '[ --jobs N ] [ --watch ] [ --source-map FILE ] '
+              '[ --server SOCKET ] [ --profile FILE [ --profile-memory ] ] '
+              '<language> <input>\n'
+              '       main.py serve [ --jobs N ] [ --socket SOCKET ]')
         sys.exit(1)
 
     main(sys.argv[1:])
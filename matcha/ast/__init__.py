@@ -1,19 +1,127 @@
-from collections import namedtuple
+from array import array
 
-Function = namedtuple('Function', 'name,args,body')
-Invocation = namedtuple('Invocation', 'func,args')
-Assignment = namedtuple('Assignment', 'src,dst')
-BinaryOperator = namedtuple(
+
+class Node:
+    """
+    Base of the syntax tree. Nodes are slotted objects that compare, print
+    and pickle like the named tuples they replaced. They only hold their
+    fields, where a node's text is in the source is kept in the Spans of
+    its tree.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def _values(self):
+        return tuple(getattr(self, f) for f in self._fields)
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+
+        for f in self._fields:
+            if getattr(self, f) != getattr(other, f):
+                return False
+
+        return True
+
+    def __hash__(self):
+        return hash((type(self).__name__,) + self._values())
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % (f, getattr(self, f)) for f in self._fields))
+
+    def __reduce__(self):
+        return type(self), self._values()
+
+
+def node(name, fields):
+    """
+    Declares a node type with the given comma separated fields, taken in
+    order or by name. Like namedtuple, __init__ and _values are generated
+    so building a node only costs the attribute stores.
+    """
+    fields = tuple(fields.split(','))
+    source = 'def __init__(self, %s):\n' % ', '.join(fields)
+    for f in fields:
+        source += '    self.%s = %s\n' % (f, f)
+    source += 'def _values(self):\n    return (%s,)\n' % ', '.join(
+        'self.' + f for f in fields)
+
+    namespace = {}
+    exec(source, namespace)
+    return type(name, (Node,), {
+        '__slots__': fields,
+        '__module__': __name__,
+        '_fields': fields,
+        '__init__': namespace['__init__'],
+        '_values': namespace['_values']})
+
+
+def walk(node):
+    """
+    Every node in the tree under node, node included, in preorder.
+    """
+    stack = [node]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, Node):
+            yield value
+            stack.extend(reversed(value._values()))
+        elif type(value) == list:
+            stack.extend(reversed(value))
+
+
+class Spans:
+    """
+    Offsets of the text of each node of tree in its source, kept beside
+    the tree in two arrays in the order walk() visits the nodes, -1 for
+    nodes that were not parsed. Nodes are looked up by identity, nodes
+    built to replace one of the tree are given its span with copy().
+    """
+    def __init__(self, tree, starts=None, ends=None):
+        self.tree = tree
+        self.starts = array('i') if starts is None else starts
+        self.ends = array('i') if ends is None else ends
+        self.index = None
+        # nodes given a span with copy, kept alive so their ids stay theirs
+        self.copies = []
+
+    def lookup(self):
+        if self.index is None:
+            self.index = {id(n): i for i, n in enumerate(walk(self.tree))}
+        return self.index
+
+    def get(self, node):
+        """
+        The (start, end) offsets of node, or None when it has none.
+        """
+        i = self.lookup().get(id(node))
+        if i is None or self.starts[i] < 0:
+            return None
+        return self.starts[i], self.ends[i]
+
+    def copy(self, node, other):
+        index = self.lookup()
+        if id(other) in index:
+            index[id(node)] = index[id(other)]
+            self.copies.append(node)
+
+
+Function = node('Function', 'name,args,body')
+Invocation = node('Invocation', 'func,args')
+Assignment = node('Assignment', 'src,dst')
+BinaryOperator = node(
     'BinaryOperator', 'first,operator,second')
-IfStatement = namedtuple('IfStatement', 'expression,body')
-Block = namedtuple('Block', 'body')
-Return = namedtuple('Return', 'result')
-Symbol = namedtuple('Symbol', 'name')
-Import = namedtuple('Import', 'name')
-
-NumericLiteral = namedtuple('NumericLiteral', 'value')
-StringLiteral = namedtuple('StringLiteral', 'value')
-ListLiteral = namedtuple('ListLiteral', 'value')
+IfStatement = node('IfStatement', 'expression,body')
+Block = node('Block', 'body')
+Return = node('Return', 'result')
+Symbol = node('Symbol', 'name')
+Import = node('Import', 'name')
+
+NumericLiteral = node('NumericLiteral', 'value')
+StringLiteral = node('StringLiteral', 'value')
+ListLiteral = node('ListLiteral', 'value')
 
 
 def get_imports(ast):
@@ -0,0 +1,51 @@
+class Dispatch:
+    """
+    Table of handlers by node type for a pass over the tree, built once when
+    the pass is defined. Calling the table runs the handler registered for
+    the node's type, or for its closest registered base class. Nodes with
+    no handler go to default, or raise RuntimeError without one.
+    """
+    def __init__(self, default=None):
+        self.handlers = {}
+        self.default = default
+        self.cache = {}
+
+    def register(self, *types):
+        def decorator(f):
+            for t in types:
+                self.handlers[t] = f
+            self.cache.clear()
+            return f
+
+        return decorator
+
+    def extend(self, default=None):
+        """
+        A new table starting with the handlers of this one, for passes that
+        only handle some nodes differently.
+        """
+        other = Dispatch(default or self.default)
+        other.handlers.update(self.handlers)
+        return other
+
+    def lookup(self, typ):
+        for base in typ.__mro__:
+            if base in self.handlers:
+                return self.handlers[base]
+
+        if self.default:
+            return self.default
+
+        def unknown(node, *args):
+            raise RuntimeError('unknown node: %r' % (node,))
+
+        return unknown
+
+    def __call__(self, node, *args):
+        typ = type(node)
+        try:
+            handler = self.cache[typ]
+        except KeyError:
+            handler = self.cache[typ] = self.lookup(typ)
+
+        return handler(node, *args)
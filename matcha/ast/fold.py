@@ -0,0 +1,238 @@
+"""
+Constant folding, run on a tree before code generation. Binary operators
+over literals are replaced by their result and if statements whose
+condition is constantly false are removed. Results have to mean the same
+in every backend, so an operation is only folded when its result is a
+literal inference gives the operands' type: integers stay in the range of
+a Java int and are only divided when the division is exact, doubles are
+only folded to finite, non negative values.
+"""
+import operator
+
+from . import (
+    Assignment, BinaryOperator, Block, Function, IfStatement, Invocation,
+    ListLiteral, NumericLiteral, Return, StringLiteral, walk)
+from .dispatch import Dispatch
+from .inference import Types, infer
+
+MAX_INT = 2 ** 31 - 1
+
+ARITHMETIC = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv
+    }
+
+COMPARISONS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge
+    }
+
+# fold(node, spans) returns node with its constant parts folded, nodes that
+# do not change are returned as they are rather than copied. Nodes built in
+# place of a node of the tree are given its span in spans, if any
+fold = Dispatch(default=lambda node, spans=None: node)
+
+
+def literal_value(node):
+    """
+    The inferred type and value of a literal, or None for other nodes.
+    """
+    if type(node) not in (NumericLiteral, StringLiteral):
+        return None
+
+    typ = (infer(node) or (None,))[0]
+    if typ == Types.Integer:
+        return typ, int(node.value)
+    if typ == Types.Double:
+        return typ, float(node.value)
+    if typ == Types.String:
+        return typ, node.value[1:-1]
+
+
+def make_literal(typ, value, node):
+    """
+    The literal for value, folded from node, or None when value cannot be
+    written as a literal of type typ.
+    """
+    if typ == Types.Integer:
+        if not 0 <= value <= MAX_INT:
+            return None
+        result = NumericLiteral(str(value))
+    elif typ == Types.Double:
+        result = NumericLiteral(repr(value))
+    else:
+        quote = node.first.value[0]
+        if quote in value:
+            return None
+        result = StringLiteral(quote + value + quote)
+
+    if (infer(result) or (None,))[0] != typ:
+        return None
+
+    return result
+
+
+def evaluate(typ, operator, a, b):
+    if typ == Types.String:
+        return a + b if operator == '+' else None
+
+    if operator == '/':
+        if b == 0:
+            return None
+        if typ == Types.Integer:
+            return a // b if a % b == 0 else None
+
+    return ARITHMETIC[operator](a, b)
+
+
+def has_calls(node):
+    return any(type(n) == Invocation for n in walk(node))
+
+
+def condition(node):
+    """
+    The value of a constant condition, or None when it is not constant.
+    """
+    if type(node) != BinaryOperator:
+        return None
+
+    if node.operator in ('and', 'or'):
+        first = condition(node.first)
+        second = condition(node.second)
+        # the value that decides the result, the first operand runs before
+        # it is known so it has to be free of calls when the second decides
+        decisive = node.operator == 'or'
+        if first is decisive or (
+                second is decisive and not has_calls(node.first)):
+            return decisive
+        if first is None or second is None:
+            return None
+        return first and second if node.operator == 'and' else first or second
+
+    if node.operator not in COMPARISONS:
+        return None
+
+    first = literal_value(node.first)
+    second = literal_value(node.second)
+    if not first or not second or first[0] != second[0]:
+        return None
+
+    if first[0] == Types.String and node.operator not in ('==', '!='):
+        return None
+
+    return COMPARISONS[node.operator](first[1], second[1])
+
+
+def unchanged(nodes, original):
+    return len(nodes) == len(original) and all(map(
+        operator.is_, nodes, original))
+
+
+def is_typed(statement):
+    return type(statement) in (Return, IfStatement)
+
+
+def replaced(node, new, spans):
+    if spans is not None:
+        spans.copy(new, node)
+    return new
+
+
+@fold.register(BinaryOperator)
+def fold_binary_operator(node, spans=None):
+    first = fold(node.first, spans)
+    second = fold(node.second, spans)
+    if first is not node.first or second is not node.second:
+        node = replaced(
+            node, BinaryOperator(first, node.operator, second), spans)
+
+    a = literal_value(first)
+    b = literal_value(second)
+    if not a or not b or a[0] != b[0] or node.operator not in ARITHMETIC:
+        return node
+
+    value = evaluate(a[0], node.operator, a[1], b[1])
+    if value is None:
+        return node
+
+    literal = make_literal(a[0], value, node)
+    if not literal:
+        return node
+    return replaced(node, literal, spans)
+
+
+def fold_statements(node, spans, typed):
+    body = [fold(statement, spans) for statement in node.body]
+    live = [statement for statement in body
+            if type(statement) != IfStatement or
+            condition(statement.expression) is not False]
+
+    # the type of a typed block, the body of a function or if statement,
+    # comes from its returns, keep the dead code rather than leave it
+    # without one
+    if typed and any(map(is_typed, body)) and not any(map(is_typed, live)):
+        live = body
+
+    if unchanged(live, node.body):
+        return node
+    return replaced(node, Block(live), spans)
+
+
+@fold.register(Block)
+def fold_block(node, spans=None):
+    return fold_statements(node, spans, typed=False)
+
+
+@fold.register(IfStatement)
+def fold_if_statement(node, spans=None):
+    expression = fold(node.expression, spans)
+    body = fold_statements(node.body, spans, typed=True)
+    if expression is node.expression and body is node.body:
+        return node
+    return replaced(node, IfStatement(expression, body), spans)
+
+
+@fold.register(Function)
+def fold_function(node, spans=None):
+    body = fold_statements(node.body, spans, typed=True)
+    if body is node.body:
+        return node
+    return replaced(node, Function(node.name, node.args, body), spans)
+
+
+@fold.register(Return)
+def fold_return(node, spans=None):
+    result = fold(node.result, spans)
+    if result is node.result:
+        return node
+    return replaced(node, Return(result), spans)
+
+
+@fold.register(Assignment)
+def fold_assignment(node, spans=None):
+    src = fold(node.src, spans)
+    if src is node.src:
+        return node
+    return replaced(node, Assignment(src, node.dst), spans)
+
+
+@fold.register(Invocation)
+def fold_invocation(node, spans=None):
+    args = [fold(arg, spans) for arg in node.args]
+    if unchanged(args, node.args):
+        return node
+    return replaced(node, Invocation(node.func, args), spans)
+
+
+@fold.register(ListLiteral)
+def fold_list_literal(node, spans=None):
+    values = [fold(value, spans) for value in node.value]
+    if unchanged(values, node.value):
+        return node
+    return replaced(node, ListLiteral(values), spans)
@@ -1,17 +1,26 @@
 from collections import namedtuple
 from enum import Enum
-from itertools import filterfalse
 
 from . import (Function, NumericLiteral, StringLiteral,
     Return, IfStatement, Invocation, Assignment,
-    Symbol, BinaryOperator, Block, ListLiteral)
+    Symbol, BinaryOperator, Block, ListLiteral, Import, walk)
+from .dispatch import Dispatch
+from ..profiling import phase
 
 Types = Enum('Types', 'Integer, Double, String, Boolean, List')
 SymbolType = namedtuple('SymbolType', 'name')
+# a list known to hold only numbers of one type, other lists are Types.List
+ListType = namedtuple('ListType', 'element')
+
+NUMERIC = {Types.Integer, Types.Double}
 
 class InferenceError(Exception):
     pass
 
+# infer(node) returns the type of node and the constraints on the symbols
+# in it, nodes without a handler have no type
+infer = Dispatch(default=lambda node: None)
+
 
 def flatten(lst):
     if type(lst) == list:
@@ -23,10 +32,12 @@ def flatten(lst):
     return []
 
 
+@infer.register(Symbol)
 def infer_symbol(node):
     return SymbolType(node.name), set()
 
 
+@infer.register(NumericLiteral)
 def infer_numeric_literal(node):
     if node.value.replace('.', '').isdigit():
         if '.' in node.value:
@@ -34,10 +45,12 @@ def infer_numeric_literal(node):
         return Types.Integer, set()
 
 
+@infer.register(StringLiteral)
 def infer_string_literal(node):
     return Types.String, set()
 
 
+@infer.register(BinaryOperator)
 def infer_binary_operator(node):
     type_a, _ = infer(node.first)
     type_b, _ = infer(node.second)
@@ -52,17 +65,21 @@ def infer_binary_operator(node):
 
     return type_a, set([(type_a, type_b)])
 
+@infer.register(Invocation)
 def infer_invocation(node):
     return SymbolType(node.func.name), set()
 
+@infer.register(Return)
 def infer_return(node):
     return infer(node.result)
 
+@infer.register(Assignment)
 def infer_assignment(node):
     type_a, _ = infer(node.src)
     type_b, _ = infer(node.dst)
-    return infer(node.src), {(type_a, type_b)}
+    return type_a, {(type_a, type_b)}
 
+@infer.register(Block)
 def infer_block(node):
     types = set()
     constrains = set()
@@ -78,12 +95,35 @@ def infer_block(node):
     if len(types) > 1:
         constrains.add(tuple(types))
 
-    return types.pop(), constrains
+    return block_type(types), constrains
+
+
+def block_type(types):
+    """
+    The type of a block returning values of types. A symbol among them
+    resolves to the type of them all through the constraint on them,
+    concrete types are joined.
+    """
+    symbols = [t for t in types if not is_concrete_type(t)]
+    if symbols:
+        return min(symbols)
+
+    types = sorted(types, key=str)
+    typ = types[0]
+    for other in types[1:]:
+        typ = join(typ, other)
+        if typ is None:
+            # the constraint on them does not resolve either
+            return types[0]
+
+    return typ
 
+@infer.register(Function)
 def infer_function(node):
     return infer(node.body)
 
 
+@infer.register(IfStatement)
 def infer_if_statement(node):
     _, cs = infer(node.expression)
     constrains = set(cs)
@@ -93,46 +133,198 @@ def infer_if_statement(node):
     return t, constrains
 
 
+@infer.register(ListLiteral)
 def infer_list(node):
-    return Types.List, set()
+    element = None
+    for value in node.value:
+        # nested lists are never numbers, no need to infer them
+        t = type(value) != ListLiteral and infer(value)
+        if not t or t[0] not in NUMERIC or element not in (None, t[0]):
+            return Types.List, set()
+        element = t[0]
+
+    if element is None:
+        return Types.List, set()
+
+    return ListType(element), set()
 
 
 def is_concrete_type(typ):
-    return isinstance(typ, Types)
+    return isinstance(typ, (Types, ListType))
+
+
+def is_list_type(typ):
+    return typ == Types.List or type(typ) == ListType
+
+
+def join(first, second):
+    """
+    The type values of both concrete types can have, None if there is none.
+    Lists of different elements are just lists.
+    """
+    if first == second:
+        return first
+    if is_list_type(first) and is_list_type(second):
+        return Types.List
+
+
+def find(parent, symbol):
+    root = symbol
+    while parent[root] != root:
+        root = parent[root]
+
+    # path compression
+    while parent[symbol] != root:
+        parent[symbol], symbol = root, parent[symbol]
+
+    return root
+
+
+def clash(constrain, first, second):
+    show = lambda c: ','.join(map(str, c))
+    return InferenceError(
+        'cannot solve constrain %s, %s from %s clashes with %s from %s' % (
+            show(constrain), first[0], show(first[1]),
+            second[0], show(second[1])))
 
 
 def resolve_types(constrains):
-    out = {}
-    for constrain in constrains:
-        if len(set(constrain)) == 1:
-            # type is equal to itself
-            continue
+    """
+    Solves constraints, tuples of types that have to be equal, by unifying
+    the symbols in them with union-find. Returns the concrete type of each
+    symbol that has one, raises InferenceError naming the clashing
+    constraints when a symbol would get two.
+    """
+    parent = {}
+    size = {}
+    # concrete type of a class and the constraint it came from, by root
+    concrete = {}
+
+    def assign(root, typ, source, constrain):
+        if root not in concrete:
+            concrete[root] = typ, source
+        elif concrete[root][0] != typ:
+            joined = join(concrete[root][0], typ)
+            if joined is None:
+                raise clash(constrain, concrete[root], (typ, source))
+            concrete[root] = joined, concrete[root][1]
 
-        types = set(filter(is_concrete_type, constrain))
-        if len(types) > 1:
-            raise InferenceError('cannot solve constrain %s' % ','.join(map(str, constrain)))
+    for constrain in constrains:
+        root = None
+        typ = None
+        for t in constrain:
+            if is_concrete_type(t):
+                if typ is None:
+                    typ = t
+                elif typ != t:
+                    typ = join(typ, t)
+                    if typ is None:
+                        raise InferenceError('cannot solve constrain %s' %
+                            ','.join(map(str, constrain)))
+                continue
+
+            if t not in parent:
+                parent[t] = t
+                size[t] = 1
+
+            other = find(parent, t)
+            if root is None:
+                root = other
+            elif other != root:
+                if size[other] > size[root]:
+                    root, other = other, root
+
+                parent[other] = root
+                size[root] += size[other]
+                if other in concrete:
+                    assign(root, *concrete.pop(other), constrain)
+
+        if root is not None and typ is not None:
+            assign(root, typ, constrain, constrain)
 
-        t = types.pop()
-        for symbol in set(filterfalse(is_concrete_type, constrain)):
-            out[symbol] = t
+    out = {}
+    for symbol in parent:
+        root = find(parent, symbol)
+        if root in concrete:
+            out[symbol] = concrete[root][0]
 
     return out
 
 
-def infer(node, known={}):
-    infers = {
-        Function: infer_function,
-        Return: infer_return,
-        NumericLiteral: infer_numeric_literal,
-        StringLiteral: infer_string_literal,
-        Symbol: infer_symbol,
-        Invocation: infer_invocation,
-        Assignment: infer_assignment,
-        BinaryOperator: infer_binary_operator,
-        Block: infer_block,
-        IfStatement: infer_if_statement,
-        ListLiteral: infer_list
-        }
-
-    default = lambda node: None
-    return infers.get(type(node), default)(node)
+class Inference:
+    """
+    Side table of inferred types for one tree, keyed by node identity and
+    shared by the backends, so each function is inferred and its
+    constraints solved only once. Functions are inferred up front, other
+    nodes on first use. The table holds on to the tree so that the
+    identities stay valid.
+    """
+    def __init__(self, ast=None):
+        self.ast = ast
+        self.table = {}
+        self.solutions = {}
+        self.destinations = None
+        if type(ast) == Block:
+            for node in ast.body:
+                if type(node) == Function:
+                    self.resolve(node)
+
+    def infer(self, node):
+        key = id(node)
+        if key not in self.table:
+            self.table[key] = infer(node)
+
+        return self.table[key]
+
+    def resolve(self, node):
+        key = id(node)
+        if key not in self.solutions:
+            constrains = self.infer(node)[1]
+            with phase('resolve'):
+                self.solutions[key] = resolve_types(constrains)
+
+        return self.solutions[key]
+
+    def return_type(self, function):
+        typ = self.infer(function)[0]
+        if not is_concrete_type(typ):
+            typ = self.resolve(function).get(typ)
+        return typ
+
+    def destination(self, node):
+        """
+        The type of where the value node goes: the symbol it is assigned
+        to, the return type of the function returning it or the argument of
+        a function of the tree it is passed to. None for other values and
+        when that type is not known.
+        """
+        if self.destinations is None:
+            self.destinations = {}
+            self.find_destinations()
+
+        return self.destinations.get(id(node))
+
+    def find_destinations(self):
+        scopes = self.ast.body if type(self.ast) == Block else [self.ast]
+        functions = {f.name: f for f in scopes if type(f) == Function}
+
+        for scope in scopes:
+            if scope is None or type(scope) == Import:
+                continue
+
+            resolved = self.resolve(scope)
+            returns = (self.return_type(scope) if type(scope) == Function
+                       else None)
+            for node in walk(scope):
+                if type(node) == Assignment:
+                    self.destinations[id(node.src)] = resolved.get(
+                        SymbolType(node.dst.name))
+                elif type(node) == Return:
+                    self.destinations[id(node.result)] = returns
+                elif (type(node) == Invocation and
+                        node.func.name in functions):
+                    callee = functions[node.func.name]
+                    arguments = self.resolve(callee)
+                    for name, arg in zip(callee.args, node.args):
+                        self.destinations[id(arg)] = arguments.get(
+                            SymbolType(name))
@@ -0,0 +1,93 @@
+"""
+Finds the functions the backends can optimize when asked to. A function is
+pure when it only reads its arguments, its own locals and literals and
+only calls itself, so its result depends on nothing but its arguments. A
+pure function that calls itself is either turned into a loop, when every
+call is a tail call, or memoized, when its arguments can be compared by
+value.
+"""
+from collections import namedtuple
+
+from . import (
+    Assignment, Block, Function, IfStatement, Invocation, Return, Symbol,
+    walk)
+from .inference import SymbolType, Types
+
+# a function turned into a LOOP runs its body in a loop, returning a call
+# to itself starts the next iteration with the call's arguments instead.
+# As for a call, all arguments are evaluated before any is assigned
+LOOP = 'loop'
+MEMOIZE = 'memoize'
+
+MEMO_TYPES = {Types.Integer, Types.Double, Types.String, Types.Boolean}
+
+Recursion = namedtuple('Recursion', 'pure,calls,tail_calls')
+
+
+def is_self_call(node, function):
+    return type(node) == Invocation and node.func.name == function.name
+
+
+def tail_calls(node, function):
+    """
+    The returns of a call to function in the statements of node, where
+    nothing is left to do after the call.
+    """
+    if type(node) == Block:
+        return [r for statement in node.body
+                for r in tail_calls(statement, function)]
+    if type(node) == IfStatement:
+        return tail_calls(node.body, function)
+    if type(node) == Return and is_self_call(node.result, function):
+        return [node]
+    return []
+
+
+def analyze(function):
+    """
+    Whether function is pure, how often it calls itself and its self
+    calls in tail position.
+    """
+    known = set(function.args)
+    known.add(function.name)
+    known.update(node.dst.name for node in walk(function.body)
+                 if type(node) == Assignment)
+
+    pure = True
+    calls = 0
+    for node in walk(function.body):
+        if type(node) == Invocation:
+            if is_self_call(node, function):
+                calls += 1
+            else:
+                pure = False
+        elif type(node) == Symbol and node.name not in known:
+            pure = False
+
+    return Recursion(pure, calls, tail_calls(function.body, function))
+
+
+def optimization(function, types):
+    """
+    LOOP or MEMOIZE for a pure recursive function, None for any other
+    node.
+    """
+    if type(function) != Function:
+        return None
+
+    recursion = analyze(function)
+    if not recursion.pure or not recursion.calls:
+        return None
+
+    body = function.body.body
+    if (len(recursion.tail_calls) == recursion.calls and
+            body and type(body[-1]) == Return):
+        return LOOP
+
+    resolved = types.resolve(function)
+    if function.args and all(
+            resolved.get(SymbolType(arg)) in MEMO_TYPES
+            for arg in function.args):
+        return MEMOIZE
+
+    return None
@@ -0,0 +1,193 @@
+"""
+Binary format for syntax trees. A tree is written as a flat stream of
+unsigned 32 bit words in preorder, strings are stored once in a table in
+front of it:
+
+    magic, version, string count, string bytes, word count
+    length of each string
+    the strings, utf-8 encoded and padded to a multiple of 4 bytes
+    the words
+
+A value is None, a string (its index in the table), a list (its length
+and then its items) or a node (its kind, the start and end offset of its
+span plus one so 0 can mean none, and then its fields in order).
+"""
+import mmap
+import sys
+from array import array
+
+from . import (
+    Assignment, BinaryOperator, Block, Function, IfStatement, Import,
+    Invocation, ListLiteral, Node, NumericLiteral, Return, Spans,
+    StringLiteral, Symbol)
+
+MAGIC = 0x5453414d  # b'MAST'
+VERSION = 1
+
+# the position of a node type in KINDS is part of the format, only append
+KINDS = (
+    Function, Invocation, Assignment, BinaryOperator, IfStatement, Block,
+    Return, Symbol, Import, NumericLiteral, StringLiteral, ListLiteral)
+
+NONE, STRING, LIST, NODE = range(4)
+
+kind_codes = {kind: NODE + i for i, kind in enumerate(KINDS)}
+
+HEADER = 5
+
+class FormatError(Exception):
+    pass
+
+
+def dumps(ast, spans=None):
+    """
+    The tree ast in binary, with the offsets in spans, the Spans of ast.
+    """
+    strings = {}
+    words = array('I')
+    add = words.append
+    # nodes are written in the order spans are stored in
+    starts = spans.starts if spans else None
+    ends = spans.ends if spans else None
+    n = 0
+
+    stack = [ast]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, Node):
+            add(kind_codes[type(value)])
+            if spans:
+                add(starts[n] + 1)
+                add(ends[n] + 1)
+                n += 1
+            else:
+                add(0)
+                add(0)
+            stack.extend(reversed(value._values()))
+        elif type(value) == str:
+            add(STRING)
+            add(strings.setdefault(value, len(strings)))
+        elif type(value) == list:
+            add(LIST)
+            add(len(value))
+            stack.extend(reversed(value))
+        elif value is None:
+            add(NONE)
+        else:
+            raise TypeError('cannot serialize %r' % (value,))
+
+    encoded = [s.encode() for s in strings]
+    text = b''.join(encoded)
+    text += b'\0' * (-len(text) % 4)
+
+    header = array('I', [MAGIC, VERSION, len(encoded), len(text), len(words)])
+    lengths = array('I', map(len, encoded))
+    if sys.byteorder != 'little':
+        for a in (header, lengths, words):
+            a.byteswap()
+
+    return b''.join((header.tobytes(), lengths.tobytes(), text,
+                     words.tobytes()))
+
+def unpack(data, count):
+    words = array('I')
+    words.frombytes(data[:count * 4])
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return words
+
+def loads(data, spans=False):
+    """
+    The tree in data, with spans the tree and its Spans.
+    """
+    data = memoryview(data)
+    if len(data) < HEADER * 4:
+        raise FormatError('truncated tree')
+
+    magic, version, count, size, length = unpack(data, HEADER)
+    if magic != MAGIC or version != VERSION:
+        raise FormatError('not a tree of format version %d' % VERSION)
+
+    pos = HEADER * 4
+    lengths = unpack(data[pos:], count)
+    pos += count * 4
+
+    strings = []
+    text = bytes(data[pos:pos + size])
+    start = 0
+    for n in lengths:
+        strings.append(text[start:start + n].decode())
+        start += n
+    pos += size
+
+    if len(data) != pos + length * 4:
+        raise FormatError('truncated tree')
+
+    tree, starts, ends = decode(unpack(data[pos:], length), strings)
+    if spans:
+        return tree, Spans(tree, starts, ends)
+    return tree
+
+def decode(words, strings):
+    pos = 0
+    starts = array('i')
+    ends = array('i')
+    # values being collected for each unfinished list or node
+    stack = []
+    try:
+        while True:
+            word = words[pos]
+            if word == NONE:
+                value = None
+                pos += 1
+            elif word == STRING:
+                value = strings[words[pos + 1]]
+                pos += 2
+            elif word == LIST:
+                count = words[pos + 1]
+                pos += 2
+                if count:
+                    stack.append((list, count, []))
+                    continue
+                value = []
+            else:
+                kind = KINDS[word - NODE]
+                starts.append(words[pos + 1] - 1)
+                ends.append(words[pos + 2] - 1)
+                pos += 3
+                stack.append((kind, len(kind._fields), []))
+                continue
+
+            # hand the value to its parent, finishing parents that are complete
+            while stack:
+                frame = stack[-1]
+                values = frame[2]
+                values.append(value)
+                if len(values) < frame[1]:
+                    break
+
+                stack.pop()
+                if frame[0] is list:
+                    value = values
+                else:
+                    value = frame[0](*values)
+            else:
+                return value, starts, ends
+    except (IndexError, KeyError, OverflowError):
+        # words or strings ran out, or a word is not what it should be
+        raise FormatError('corrupt tree')
+
+def dump(ast, f, spans=None):
+    f.write(dumps(ast, spans))
+
+def load(f, spans=False):
+    """
+    Reads a tree from a file opened in binary mode, mapping it into memory
+    instead of reading it.
+    """
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        view = memoryview(m)
+        try:
+            return loads(view, spans)
+        finally:
+            view.release()
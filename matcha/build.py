@@ -0,0 +1,434 @@
+import io
+import logging
+import os
+from collections import defaultdict, namedtuple
+
+from .ast import get_imports
+from .ast.fold import fold
+from .ast.inference import Inference
+from . import profiling
+from .cache import open_cache
+from .parsing import Grammar, Source, grammar
+from .profiling import phase
+
+log = logging.getLogger(__name__)
+
+def parse(text, packrat=False, spans=False):
+    """
+    The tree parsed from text and, with spans, its Spans. The tree is None
+    when text does not parse.
+    """
+    with phase('lex'):
+        source = Source(text, packrat, lexed=True)
+
+    with phase('parse'):
+        profile = profiling.active
+        result = (Grammar(profile) if profile else grammar()).parse(source)
+    if packrat:
+        log.info('packrat: %d hits, %d misses', source.hits, source.misses)
+
+    if not result:
+        log.critical('failed parsing')
+        return None, None
+
+    ast, rest = result
+    if rest:
+        log.critical('failed parsing, leftover: %s', rest)
+        log.critical(ast)
+        return None, None
+
+    return ast, source.spans(ast) if spans else None
+
+
+def std_lookup(module_name, language):
+    possible = [
+        '%s.%s' % (module_name, 'tea'),
+        '%s.%s' % (module_name, language)]
+
+    std_path = os.getenv('MATCHA_LIB', 'matcha/std')
+    return [os.path.join(std_path, p)
+            for p in possible]
+
+
+def module_lookup(module_name, parent_path, language):
+    for filename in std_lookup(module_name, language):
+        if os.path.exists(filename):
+            return filename, True
+
+    possible = (
+        parent_path,
+        os.getcwd())
+
+    possible = [os.path.join(
+        p, '%s.%s' % (module_name, 'tea'))
+        for p in possible]
+
+    for filename in possible:
+        if os.path.exists(filename):
+            return filename, False
+
+    return None, False
+
+def should_compile(source):
+    return source.endswith('.tea')
+
+def import_names(ast):
+    return [import_.name for import_ in get_imports(ast.body)]
+
+
+def compile_module(out, module_name, ast, language, is_main=False,
+                   optimize=False):
+    with phase('fold'):
+        # streams that map the code back to the source carry the spans
+        ast = fold(ast, getattr(out, 'spans', None))
+    with phase('infer'):
+        types = Inference(ast)
+
+    with phase('generate'):
+        # backends are imported when a build needs them, short compiles
+        # are dominated by startup
+        if language == 'js':
+            from .js import emit_program as emit_js
+            emit_js(ast, out, types, optimize)
+        elif language == 'java':
+            from .java import bootstrap_imports
+            from .java import emit_program as emit_java
+            out.write(bootstrap_imports())
+            out.write('public class %s {' % module_name)
+            if is_main:
+                out.write(
+                    'public static void main(String[] args) { matcha_main(); }')
+            emit_java(ast, out, types, optimize)
+            out.write('}')
+        else:
+            raise RuntimeError('Unknown backend: %s' % language)
+
+def compile_source(text, module_name, language, is_main=False,
+                   cache=None, packrat=False, mappings=None, optimize=False):
+    """
+    Parses and compiles a module, returning its AST and generated code.
+    With a cache, unchanged modules are neither parsed nor compiled again.
+    Given a mappings list, source map mappings of the code are added to
+    it, cached modules are then only not parsed again. optimize turns on
+    the optimizations of the backends for pure recursive functions.
+    """
+    with phase('compile'):
+        entry = None
+        if cache:
+            with phase('cache'):
+                key = cache.key(text, module_name, language, is_main, optimize)
+                entry = cache.get(key)
+            if entry and mappings is None:
+                return entry[:2]
+
+        if entry:
+            ast, _, spans = entry
+        else:
+            # spans are only worked out for the cache and source maps
+            spans = cache is not None or mappings is not None
+            ast, spans = parse(text, packrat, spans)
+        if not ast:
+            return None, None
+
+        out = io.StringIO()
+        if mappings is None:
+            compile_module(out, module_name, ast, language, is_main, optimize)
+        else:
+            from .js.sourcemap import Marker
+            marker = Marker(out, text, spans)
+            compile_module(
+                marker, module_name, ast, language, is_main, optimize)
+            mappings.extend(marker.mappings())
+
+        if cache and not entry:
+            with phase('cache'):
+                cache.put(key, (ast, out.getvalue(), spans))
+
+        return ast, out.getvalue()
+
+def compile_file(filename, module_name, language, packrat=False,
+                 source_map=False, optimize=False):
+    """
+    Compiles a module file, returning the names it imports, its code and
+    with source_map its source map mappings.
+    """
+    mappings = [] if source_map else None
+    ast, output = compile_source(
+        open(filename).read(), module_name, language,
+        cache=open_cache(), packrat=packrat, mappings=mappings,
+        optimize=optimize)
+    if not ast:
+        return [], None, None
+
+    return import_names(ast), output, mappings
+
+def compile_files(jobs, modules, language, packrat=False, executor=None,
+                  source_map=False, optimize=False):
+    """
+    Compiles (filename, module_name) pairs, in a pool of worker processes
+    when jobs > 1, and returns their results in the same order. A running
+    executor is reused instead of starting a new pool.
+    """
+    filenames = [filename for filename, _ in modules]
+    names = [name for _, name in modules]
+    languages = [language] * len(modules)
+    packrats = [packrat] * len(modules)
+    source_maps = [source_map] * len(modules)
+    optimizes = [optimize] * len(modules)
+    args = filenames, names, languages, packrats, source_maps, optimizes
+
+    if executor and len(modules) > 1:
+        return list(executor.map(compile_file, *args))
+
+    if jobs > 1 and len(modules) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(jobs, len(modules))) as executor:
+            return list(executor.map(compile_file, *args))
+
+    return list(map(compile_file, *args))
+
+
+Module = namedtuple('Module', 'name,filename,is_std,imports,output,mappings')
+
+class ModuleGraph:
+    """
+    Every module a program imports, directly or through other modules.
+    Lookups are cached and each module is compiled once, however many
+    modules import it. Modules that are not compiled (native std modules)
+    have no imports and no output. With source_map, compiled modules come
+    with the source map mappings of their code.
+    """
+    def __init__(self, language, jobs=1, packrat=False, executor=None,
+                 source_map=False, optimize=False):
+        self.language = language
+        self.jobs = jobs
+        self.packrat = packrat
+        self.executor = executor
+        self.source_map = source_map
+        self.optimize = optimize
+        self.lookups = {}
+        self.modules = {}
+
+    def lookup(self, module_name, parent_path):
+        key = module_name, parent_path
+        if key not in self.lookups:
+            with phase('lookup'):
+                filename, is_std = module_lookup(
+                    module_name, parent_path, self.language)
+            if not filename:
+                raise RuntimeError('could not find module: %s' % module_name)
+
+            self.lookups[key] = filename, is_std
+
+        return self.lookups[key]
+
+    def add(self, imports, parent_path):
+        """
+        Adds the modules named in imports and all modules they import. The
+        graph is discovered a level at a time, compiling the new modules of
+        each level together. Returns False if any of these modules failed
+        to compile.
+        """
+        ok = True
+        seen = set()
+        pending = [(name, parent_path) for name in imports]
+        while pending:
+            found = {}
+            known = []
+            for name, path in pending:
+                filename, is_std = self.lookup(name, path)
+                other = self.modules.get(name) or found.get(name)
+                if other and other[1] != filename:
+                    raise RuntimeError(
+                        'module %s found at both %s and %s' %
+                        (name, other[1], filename))
+
+                if name in seen:
+                    continue
+
+                seen.add(name)
+                if name in self.modules:
+                    known.append(self.modules[name])
+                else:
+                    found[name] = name, filename, is_std
+
+            compiled = compile_files(
+                self.jobs,
+                [(filename, name) for name, filename, _ in found.values()
+                 if should_compile(filename)],
+                self.language, self.packrat, self.executor, self.source_map,
+                self.optimize)
+
+            for name, filename, is_std in found.values():
+                imports, output, mappings = [], None, None
+                if should_compile(filename):
+                    imports, output, mappings = compiled.pop(0)
+                    if output is None:
+                        log.critical('failed compiling module: %s', name)
+
+                known.append(Module(
+                    name, filename, is_std, imports, output, mappings))
+                self.modules[name] = known[-1]
+
+            pending = []
+            for module in known:
+                if should_compile(module.filename) and module.output is None:
+                    ok = False
+
+                path = os.path.dirname(module.filename)
+                pending.extend((i, path) for i in module.imports)
+
+        return ok
+
+    def importers(self, names):
+        """
+        The given modules and all modules that import them, directly or
+        through other modules.
+        """
+        importers = defaultdict(list)
+        for module in self.modules.values():
+            for name in module.imports:
+                importers[name].append(module.name)
+
+        found = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in found:
+                found.add(name)
+                pending.extend(importers[name])
+
+        return found
+
+    def discard(self, names):
+        """
+        Forgets modules, so the next add() compiles them again.
+        """
+        for name in names:
+            self.modules.pop(name, None)
+
+    def order(self, roots):
+        """
+        The modules reachable from roots, each one after all the modules it
+        imports. Raises RuntimeError on an import cycle.
+        """
+        order = []
+        done = set()
+        for root in roots:
+            if root in done:
+                continue
+
+            path = [root]
+            stack = [iter(self.modules[root].imports)]
+            while stack:
+                for name in stack[-1]:
+                    if name in path:
+                        cycle = path[path.index(name):] + [name]
+                        raise RuntimeError(
+                            'import cycle: %s' % ' -> '.join(cycle))
+
+                    if name not in done:
+                        path.append(name)
+                        stack.append(iter(self.modules[name].imports))
+                        break
+                else:
+                    stack.pop()
+                    name = path.pop()
+                    done.add(name)
+                    order.append(self.modules[name])
+
+        return order
+
+
+def write_if_changed(filename, text):
+    if os.path.exists(filename):
+        with open(filename) as f:
+            if f.read() == text:
+                return
+
+    with open(filename, 'w') as out:
+        out.write(text)
+
+def link_module(out, filename, module_name, language, is_std=False,
+                source=None, mappings=None, text=None):
+    """
+    Links a module into out, its code is text or else read from filename.
+    """
+    if language == 'java':
+        if is_std:
+            out.write('import matcha.std.%s;' % module_name)
+    else:
+        out.write('var %s = (function(){var exports = {};' % module_name)
+        if mappings is not None:
+            out.include(source, mappings)
+        if text is None:
+            with open(filename) as f:
+                text = f.read()
+        out.write(text)
+        out.write('return exports;})();')
+
+def build(out, graph, ast, output, parent_path, language,
+          source=None, mappings=None):
+    """
+    Compiles the modules the program imports, unless the graph already
+    holds them, and links them with the program's output into out. With
+    output None, the program is compiled last, straight into out, so its
+    code is never held whole; out then has the code linked so far when the
+    program fails to compile. With mappings of the program, which is read
+    from source, out is a source map writer and the mappings of all modules
+    are included in it.
+    """
+    imports = import_names(ast)
+    if not graph.add(imports, parent_path):
+        return False
+
+    with phase('link'):
+        for module in graph.order(imports):
+            if should_compile(module.filename):
+                output_filename = '%s.%s' % (module.name, language)
+                write_if_changed(output_filename, module.output)
+
+                link_module(out, output_filename, module.name, language,
+                            source=module.filename, mappings=module.mappings,
+                            text=module.output)
+            else:
+                link_module(out, module.filename, module.name, language,
+                            is_std=True)
+
+        if mappings is not None:
+            out.include(source, mappings)
+        if output is not None:
+            out.write(output)
+
+    if output is None:
+        with phase('compile'):
+            compile_module(out, 'Program', ast, language, is_main=True,
+                           optimize=graph.optimize)
+    return True
+
+
+def changed(filenames, stamps):
+    """
+    The files whose content changed since they were last seen, stamps maps
+    each seen file to its modification time and content and is updated.
+    Files are only read again when their modification time changed.
+    """
+    out = []
+    for filename in filenames:
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+        except FileNotFoundError:
+            continue
+
+        stamp = stamps.get(filename)
+        if stamp and stamp[0] == mtime:
+            continue
+
+        with open(filename) as f:
+            text = f.read()
+
+        stamps[filename] = mtime, text
+        if not stamp or stamp[1] != text:
+            out.append(filename)
+
+    return out
@@ -0,0 +1,147 @@
+import logging
+import mmap
+import os
+import struct
+from functools import lru_cache
+
+from .ast import serialize
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 64 * 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def compiler_version():
+    """
+    Fingerprint of the compiler's own sources, so entries written by a
+    different compiler are never reused.
+    """
+    import hashlib
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for path, dirs, files in sorted(os.walk(root)):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith('.py'):
+                digest.update(filename.encode())
+                with open(os.path.join(path, filename), 'rb') as f:
+                    digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+class Cache:
+    """
+    Content addressed store of compiled modules. Entries are keyed by a
+    hash of the source, module name, backend and compiler version, hold the
+    module's AST, generated output and the Spans of the AST, and the least
+    recently used ones are evicted once the directory grows past max_size
+    bytes. An entry file is the length of the serialized AST, the AST with
+    its spans and then the output, and is mapped into memory to be read.
+    """
+    suffix = '.entry'
+
+    def __init__(self, path, max_size=DEFAULT_SIZE):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, text, module_name, language, is_main=False,
+            optimize=False):
+        import hashlib
+
+        digest = hashlib.sha256()
+        for part in (compiler_version(), language, module_name,
+                     str(is_main), str(optimize), text):
+            digest.update(part.encode())
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def get(self, key):
+        filename = self.filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                entry = self.read(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning('dropping unreadable cache entry %s: %s', key, e)
+            self.remove(filename)
+            return None
+
+        # the modification time orders entries for eviction, the entry may
+        # have been evicted by another process since it was read
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            pass
+        return entry
+
+    def read(self, f):
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+            try:
+                size, = struct.unpack_from('<I', view)
+                ast, spans = serialize.loads(view[4:4 + size], spans=True)
+                output = str(view[4 + size:], 'utf-8')
+            finally:
+                view.release()
+
+        return ast, output, spans
+
+    def put(self, key, entry):
+        ast, output, spans = entry
+        import tempfile
+
+        tree = serialize.dumps(ast, spans)
+
+        fd, temp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(struct.pack('<I', len(tree)))
+            f.write(tree)
+            f.write(output.encode())
+
+        os.replace(temp, self.filename(key))
+        self.evict()
+
+    def remove(self, filename):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(self.suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # removed by another process sharing the directory
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        entries.sort()
+        while total > self.max_size and entries:
+            _, size, filename = entries.pop(0)
+            self.remove(filename)
+            total -= size
+
+
+def open_cache():
+    """
+    The cache configured by MATCHA_CACHE and MATCHA_CACHE_SIZE, if any.
+    """
+    path = os.getenv('MATCHA_CACHE')
+    if not path:
+        return None
+
+    return Cache(path, int(os.getenv('MATCHA_CACHE_SIZE', DEFAULT_SIZE)))
@@ -0,0 +1,39 @@
+"""
+Client of the compile server. It only imports what talking to the server
+takes, so compiling through it does not pay for loading the compiler.
+"""
+import json
+import os
+import socket
+import sys
+
+# variables of the client's environment that change what a job compiles,
+# the server compiles the job with their values
+ENVIRONMENT = ('MATCHA_LIB', 'MATCHA_CACHE', 'MATCHA_CACHE_SIZE')
+
+
+def request(path, job):
+    """
+    Sends a job to the server listening at path and returns the reply.
+    """
+    with socket.socket(socket.AF_UNIX) as s:
+        s.connect(path)
+        s.sendall((json.dumps(job) + '\n').encode())
+        s.shutdown(socket.SHUT_WR)
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+def compile_job(language, filename, optimize=False):
+    """
+    A job compiling the program in filename, '-' for stdin.
+    """
+    job = {'id': 0, 'language': language, 'cwd': os.getcwd(),
+           'optimize': optimize,
+           'env': {name: os.environ[name] for name in ENVIRONMENT
+                   if name in os.environ}}
+    if filename == '-':
+        job['source'] = sys.stdin.read()
+    else:
+        job['filename'] = os.path.abspath(filename)
+
+    return job
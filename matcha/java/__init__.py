@@ -1,55 +1,91 @@
+import io
 import logging
-import os
 
 from ..ast import (
     Assignment, BinaryOperator, Block, Function, IfStatement, Import,
     Invocation, ListLiteral, NumericLiteral, Return, StringLiteral,
     Symbol)
+from ..ast.dispatch import Dispatch
 from ..ast.inference import (
-    InferenceError, SymbolType, Types, infer, is_concrete_type, resolve_types)
+    Inference, InferenceError, ListType, SymbolType, Types)
+from ..ast.purity import LOOP, MEMOIZE, is_self_call, optimization
 
 log = logging.getLogger(__name__)
 
-def join_arguments(args):
-    out = []
-    for arg in args:
+emitters = Dispatch()
+
+def emit_joined(nodes, separator, out, types):
+    for i, node in enumerate(nodes):
+        if i:
+            out.write(separator)
+        emit(node, out, types)
+
+
+def emit_arguments(args, out, types):
+    for i, arg in enumerate(args):
+        if i:
+            out.write(',')
         if type(arg) == str:
-            out.append(arg)
+            out.write(arg)
         else:
-            out.append(generate(arg))
-    return ','.join(out)
-
+            emit(arg, out, types)
+
+
+TYPES = {
+    Types.Integer: 'int',
+    Types.Double: 'double',
+    Types.String: 'String',
+    Types.Boolean: 'boolean',
+    Types.List: 'List'
+    }
+
+BOXED = {
+    Types.Integer: 'Integer',
+    Types.Double: 'Double',
+    Types.String: 'String',
+    Types.Boolean: 'Boolean',
+    Types.List: 'List'
+    }
+
+ARRAYS = {
+    Types.Integer: 'int[]',
+    Types.Double: 'double[]'
+    }
 
 def generate_type(typ):
-    return {
-        Types.Integer: 'int',
-        Types.Double: 'double',
-        Types.String: 'String',
-        Types.List: 'List'
-        }[typ]
+    """
+    The Java type for typ. Lists of numbers are primitive arrays so their
+    elements are not boxed.
+    """
+    if type(typ) == ListType:
+        return ARRAYS[typ.element]
+    return TYPES[typ]
 
 
-def generate_block_symbols(node, exclude=()):
-    infered_return, constrains = infer(node)
-    resolved = resolve_types(constrains)
+def generate_boxed_type(typ):
+    """
+    The Java type for typ that is an object, arrays already are.
+    """
+    if type(typ) == ListType:
+        return ARRAYS[typ.element]
+    return BOXED[typ]
 
-    local_symbols = []
-    for t in resolved:
-        if type(t) == SymbolType and not t.name in exclude:
-            local_symbols.append('%s %s;' % (generate_type(resolved[t]), t.name))
-
-    return '\n'.join(local_symbols)
 
+def emit_block_symbols(node, out, types, exclude=()):
+    resolved = types.resolve(node)
 
-def generate_function(node):
-    body = generate_block(node.body)
-    infered_return, constrains = infer(node)
-    resolved = resolve_types(constrains)
+    first = True
+    for t in resolved:
+        if type(t) == SymbolType and not t.name in exclude:
+            if not first:
+                out.write('\n')
+            out.write('%s %s;' % (generate_type(resolved[t]), t.name))
+            first = False
 
-    if not is_concrete_type(infered_return):
-        infered_return = resolved[infered_return]
 
-    return_type = generate_type(infered_return)
+def argument_types(node, types):
+    _, constrains = types.infer(node)
+    resolved = types.resolve(node)
 
     args = {}
     for arg in node.args:
@@ -62,84 +98,198 @@ def generate_function(node):
         if not found:
             raise InferenceError('could not infer type of argument: %s' % arg)
 
+    return args
+
+
+def emit_method(node, out, types, name, emit_body):
+    args = argument_types(node, types)
+
     args_generated = []
     for arg, type_ in args.items():
         args_generated.append('%s %s' % (type_, arg))
 
     exclude_symbols = set([node.name]).union(args)
-    return ('public static %s %s(%s) { %s\n%s };' %
-            (return_type, node.name, join_arguments(args_generated),
-                generate_block_symbols(node, exclude=exclude_symbols), body))
-
-
-def generate_invocation(node):
-    return ('%s(%s)' %
-            (''.join(node.func), join_arguments(node.args)))
-
-
-def generate_assignment(node):
-    return ('%s = %s;' % (node.dst.name, generate(node.src)))
-
+    out.write('public static %s %s(' % (
+        generate_type(types.return_type(node)), name))
+    emit_arguments(args_generated, out, types)
+    out.write(') { ')
+    emit_block_symbols(node, out, types, exclude=exclude_symbols)
+    out.write('\n')
+    emit_body(node.body, out, types)
+    out.write(' };')
+
+
+@emitters.register(Function)
+def emit_function(node, out, types):
+    emit_method(node, out, types, node.name, emit_block)
+
+
+def emit_loop_statement(node, out, types, function, args):
+    """
+    Writes a statement of a function turned into a LOOP.
+    """
+    if type(node) == Block:
+        for i, statement in enumerate(node.body):
+            if i:
+                out.write(';')
+            emit_loop_statement(statement, out, types, function, args)
+    elif type(node) == IfStatement:
+        out.write('if(')
+        emit(node.expression, out, types)
+        out.write(') { ')
+        emit_loop_statement(node.body, out, types, function, args)
+        out.write(' }')
+    elif type(node) == Return and is_self_call(node.result, function):
+        out.write('{ ')
+        for arg, value in zip(function.args, node.result.args):
+            out.write('%s %s$ = ' % (args[arg], arg))
+            emit(value, out, types)
+            out.write('; ')
+        for arg in function.args:
+            out.write('%s = %s$; ' % (arg, arg))
+        out.write('continue; }')
+    else:
+        emit(node, out, types)
+
+
+def emit_loop_function(node, out, types):
+    args = argument_types(node, types)
+
+    def emit_body(body, out, types):
+        out.write('while (true) { ')
+        emit_loop_statement(body, out, types, node, args)
+        out.write(' }')
+
+    emit_method(node, out, types, node.name, emit_body)
+
+
+def emit_memoized_function(node, out, types):
+    """
+    Writes a method that remembers its results by argument, in front of
+    the method computing them. Calls in the function go through the memo
+    as well.
+    """
+    args = argument_types(node, types)
+    result = generate_boxed_type(types.return_type(node))
+    names = ','.join(node.args)
+
+    out.write('static java.util.HashMap<List<Object>, %s> %s$memo = '
+              'new java.util.HashMap<>();\n' % (result, node.name))
+    out.write('public static %s %s(%s) { ' % (
+        generate_type(types.return_type(node)), node.name,
+        ','.join('%s %s' % (args[arg], arg) for arg in node.args)))
+    out.write('List<Object> key$ = Arrays.<Object>asList(%s); ' % names)
+    out.write('%s result$ = %s$memo.get(key$); ' % (result, node.name))
+    out.write('if (result$ == null) { result$ = %s$body(%s); '
+              '%s$memo.put(key$, result$); } ' % (node.name, names, node.name))
+    out.write('return result$; };\n')
+    emit_method(node, out, types, node.name + '$body', emit_block)
+
+
+@emitters.register(Invocation)
+def emit_invocation(node, out, types):
+    out.write(node.func.name)
+    out.write('(')
+    emit_arguments(node.args, out, types)
+    out.write(')')
+
+
+@emitters.register(Assignment)
+def emit_assignment(node, out, types):
+    out.write('%s = ' % node.dst.name)
+    emit(node.src, out, types)
+    out.write(';')
+
+
+OPERATORS = {
+    'and': '&&',
+    'or': '||'
+    }
+
+@emitters.register(BinaryOperator)
+def emit_binary_operator(node, out, types):
+    out.write('(')
+    emit(node.first, out, types)
+    out.write(' %s ' % OPERATORS.get(node.operator, node.operator))
+    emit(node.second, out, types)
+    out.write(')')
+
+
+@emitters.register(IfStatement)
+def emit_if_statement(node, out, types):
+    out.write('if(')
+    emit(node.expression, out, types)
+    out.write(') { ')
+    emit_block(node.body, out, types)
+    out.write(' }')
+
+
+@emitters.register(Block)
+def emit_block(node, out, types):
+    emit_joined(node.body, ';', out, types)
+
+
+@emitters.register(Return)
+def emit_return(node, out, types):
+    out.write('return ')
+    emit(node.result, out, types)
+    out.write(';')
+
+
+@emitters.register(StringLiteral)
+def emit_string_literal(node, out, types):
+    out.write('"' + node.value[1:-1]  + '"')
+
+
+@emitters.register(NumericLiteral)
+def emit_numeric_literal(node, out, types):
+    out.write(node.value)
+
+
+@emitters.register(ListLiteral)
+def emit_list_literal(node, out, types):
+    # a list of numbers only is an array when it goes where one is
+    # expected, elsewhere it is a List and its elements boxed
+    typ, _ = types.infer(node)
+    if type(typ) == ListType and types.destination(node) == typ:
+        out.write('new %s{' % generate_type(typ))
+        emit_joined(node.value, ',', out, types)
+        out.write('}')
+    else:
+        out.write('Arrays.asList(')
+        emit_joined(node.value, ',', out, types)
+        out.write(')')
 
-def generate_binary_operator(node):
-    return ('(%s %s %s)' % (
-        generate(node.first),
-        node.operator,
-        generate(node.second)))
 
+@emitters.register(Symbol)
+def emit_symbol(node, out, types):
+    out.write(node.name)
+
+
+def emit(node, out, types=None):
+    """
+    Writes the code for node to out, a text stream or anything else with a
+    write method.
+    """
+    if types is None:
+        types = Inference(node)
+
+    emitters(node, out, types)
+
+def generate(node, types=None):
+    out = io.StringIO()
+    emit(node, out, types)
+    return out.getvalue()
 
-def generate_if_statement(node):
-    return ('if(%s) { %s }' % (generate(node.expression),
-            generate_block(node.body)))
 
+def emit_program(ast, out, types=None, optimize=False):
+    """
+    Writes the methods of a module and its main method. With optimize,
+    pure recursive functions are turned into loops or memoized.
+    """
+    if types is None:
+        types = Inference(ast)
 
-def generate_block(node):
-    return ';'.join(generate(x) for x in node.body)
-
-
-def generate_return(node):
-    return 'return %s;' % generate(node.result)
-
-
-def generate_string_literal(node):
-    return '"' + node.value[1:-1]  + '"'
-
-
-def generate_numeric_literal(node):
-    return node.value
-
-
-def generate_list_literal(node):
-    return 'Arrays.asList(%s)' % (
-        ','.join(map(generate, node.value)))
-
-
-def generate_symbol(node):
-    return node.name
-
-
-def generate(node):
-    generators = {
-        Function: generate_function,
-        Invocation: generate_invocation,
-        Assignment: generate_assignment,
-        BinaryOperator: generate_binary_operator,
-        IfStatement: generate_if_statement,
-        Block: generate_block,
-        Return: generate_return,
-        NumericLiteral: generate_numeric_literal,
-        StringLiteral: generate_string_literal,
-        ListLiteral: generate_list_literal,
-        Symbol: generate_symbol,
-        }
-
-    try:
-        return generators[type(node)](node)
-    except KeyError:
-        raise RuntimeError('unknown node: %r' % (node,))
-
-
-def generate_program(ast):
     definitions = []
     main = []
 
@@ -149,11 +299,28 @@ def generate_program(ast):
         elif type(node) != Import:
             main.append(node)
 
-    symbols = ''.join(generate_block_symbols(m) for m in main)
+    for i, node in enumerate(definitions):
+        if i:
+            out.write('\n')
 
-    return '\n'.join(generate(d) for d in definitions) + \
-        'public static void matcha_main() { %s\n%s; }' % \
-        (symbols, ';\n'.join(generate(x) for x in main))
+        how = optimize and optimization(node, types)
+        if how == LOOP:
+            emit_loop_function(node, out, types)
+        elif how == MEMOIZE:
+            emit_memoized_function(node, out, types)
+        else:
+            emit(node, out, types)
+    out.write('public static void matcha_main() { ')
+    for m in main:
+        emit_block_symbols(m, out, types)
+    out.write('\n')
+    emit_joined(main, ';\n', out, types)
+    out.write('; }')
+
+def generate_program(ast, types=None):
+    out = io.StringIO()
+    emit_program(ast, out, types)
+    return out.getvalue()
 
 
 def bootstrap_imports():
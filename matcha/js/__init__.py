@@ -1,37 +1,46 @@
-import os
+import io
 
 from ..ast import (Assignment, BinaryOperator, Block, Function, IfStatement,
    Invocation, NumericLiteral, StringLiteral, Return, Symbol, ListLiteral,
    Import)
-from ..ast.inference import infer, SymbolType, resolve_types, is_concrete_type, InferenceError
+from ..ast.dispatch import Dispatch
+from ..ast.inference import Inference, SymbolType, is_concrete_type, InferenceError
+from ..ast.purity import LOOP, MEMOIZE, is_self_call, optimization
 
+emitters = Dispatch()
 
-def join_arguments(args):
-    out = []
-    for arg in args:
+def emit_joined(nodes, separator, out, types):
+    for i, node in enumerate(nodes):
+        if i:
+            out.write(separator)
+        emit(node, out, types)
+
+
+def emit_arguments(args, out, types):
+    for i, arg in enumerate(args):
+        if i:
+            out.write(',')
         if type(arg) == str:
-            out.append(arg)
+            out.write(arg)
         else:
-            out.append(generate(arg))
-    return ','.join(out)
+            emit(arg, out, types)
 
 
-def generate_block_symbols(node, exclude=()):
-    infered_return, constrains = infer(node)
-    resolved = resolve_types(constrains)
+def emit_block_symbols(node, out, types, exclude=()):
+    resolved = types.resolve(node)
 
-    local_symbols = []
+    first = True
     for t in resolved:
         if type(t) == SymbolType and not t.name in exclude:
-            local_symbols.append('var %s;' % t.name)
-
-    return '\n'.join(local_symbols)
+            if not first:
+                out.write('\n')
+            out.write('var %s;' % t.name)
+            first = False
 
 
-def generate_function(node):
-    body = generate_block(node.body)
-    infered_return, constrains = infer(node)
-    resolved = resolve_types(constrains)
+def argument_types(node, types):
+    infered_return, constrains = types.infer(node)
+    resolved = types.resolve(node)
 
     if not is_concrete_type(infered_return):
         infered_return = resolved[infered_return]
@@ -47,80 +56,203 @@ def generate_function(node):
         if not found:
             raise InferenceError('could not infer type of argument: %s' % arg)
 
-    args_generated = []
-    for arg, type_ in args.items():
-        args_generated.append('%s %s' % (type_, arg))
+    return args
+
+
+def emit_lambda(node, out, types, emit_body):
+    args = argument_types(node, types)
 
     exclude_symbols = set([node.name]).union(args)
-    return ('var {name} = function({args}) {{ {symbols}\n{body} }};'
-            'exports.{name} = {name};'.format(
-                name=node.name, args=join_arguments(node.args),
-                symbols=generate_block_symbols(node, exclude=exclude_symbols),
-                body=body))
+    out.write('function(')
+    emit_arguments(node.args, out, types)
+    out.write(') { ')
+    emit_block_symbols(node, out, types, exclude=exclude_symbols)
+    out.write('\n')
+    emit_body(node.body, out, types)
+    out.write(' }')
+
+
+@emitters.register(Function)
+def emit_function(node, out, types):
+    out.write('var %s = ' % node.name)
+    emit_lambda(node, out, types, emit_block)
+    out.write(';exports.%s = %s;' % (node.name, node.name))
+
+
+def emit_loop_statement(node, out, types, function):
+    """
+    Writes a statement of a function turned into a LOOP.
+    """
+    if type(node) == Block:
+        for i, statement in enumerate(node.body):
+            if i:
+                out.write(';')
+            emit_loop_statement(statement, out, types, function)
+    elif type(node) == IfStatement:
+        mark(node, out)
+        out.write('if(')
+        emit(node.expression, out, types)
+        out.write(') { ')
+        emit_loop_statement(node.body, out, types, function)
+        out.write(' }')
+    elif type(node) == Return and is_self_call(node.result, function):
+        mark(node, out)
+        out.write('{ ')
+        for arg, value in zip(function.args, node.result.args):
+            out.write('var %s$ = ' % arg)
+            emit(value, out, types)
+            out.write('; ')
+        for arg in function.args:
+            out.write('%s = %s$; ' % (arg, arg))
+        out.write('continue; }')
+    else:
+        emit(node, out, types)
+
+
+def emit_loop_function(node, out, types):
+    def emit_body(body, out, types):
+        out.write('while (true) { ')
+        emit_loop_statement(body, out, types, node)
+        out.write(' }')
+
+    out.write('var %s = ' % node.name)
+    emit_lambda(node, out, types, emit_body)
+    out.write(';exports.%s = %s;' % (node.name, node.name))
+
+
+def emit_memoized_function(node, out, types):
+    """
+    Writes a function that remembers its results by argument, calls in
+    the function go through the memo as well.
+    """
+    args = ','.join(node.args)
+    if len(node.args) == 1:
+        key = args
+    else:
+        key = 'JSON.stringify([%s])' % args
+
+    out.write('var %s = (function() { var memo$ = new Map(); var body$ = '
+              % node.name)
+    emit_lambda(node, out, types, emit_block)
+    out.write(
+        '; return function(%s) { var key$ = %s; '
+        'if (!memo$.has(key$)) { memo$.set(key$, body$(%s)); } '
+        'return memo$.get(key$); }; })();' % (args, key, args))
+    out.write('exports.%s = %s;' % (node.name, node.name))
+
+
+@emitters.register(Invocation)
+def emit_invocation(node, out, types):
+    out.write(node.func.name)
+    out.write('(')
+    emit_arguments(node.args, out, types)
+    out.write(')')
+
+
+@emitters.register(Assignment)
+def emit_assignment(node, out, types):
+    assert type(node.dst) == Symbol
 
+    out.write('%s = ' % node.dst.name)
+    emit(node.src, out, types)
+    out.write(';')
 
-def generate_invocation(node):
-    return ('%s(%s)' %
-            (''.join(node.func), join_arguments(node.args)))
 
+OPERATORS = {
+    'and': '&&',
+    'or': '||'
+    }
 
-def generate_assignment(node):
-    assert type(node.dst) == Symbol
+@emitters.register(BinaryOperator)
+def emit_binary_operator(node, out, types):
+    out.write('(')
+    emit(node.first, out, types)
+    out.write(' %s ' % OPERATORS.get(node.operator, node.operator))
+    emit(node.second, out, types)
+    out.write(')')
+
+
+@emitters.register(IfStatement)
+def emit_if_statement(node, out, types):
+    out.write('if(')
+    emit(node.expression, out, types)
+    out.write(') { ')
+    emit_block(node.body, out, types)
+    out.write(' }')
 
-    return ('%s = %s;' % (node.dst.name, generate(node.src)))
 
+@emitters.register(Block)
+def emit_block(node, out, types):
+    emit_joined(node.body, ';', out, types)
 
-def generate_binary_operator(node):
-    return ('(%s %s %s)' % (
-        generate(node.first),
-        node.operator,
-        generate(node.second)))
 
+@emitters.register(Return)
+def emit_return(node, out, types):
+    out.write('return ')
+    emit(node.result, out, types)
 
-def generate_if_statement(node):
-    return ('if(%s) { %s }' % (generate(node.expression),
-            generate_block(node.body)))
 
+@emitters.register(StringLiteral, NumericLiteral)
+def emit_literal(node, out, types):
+    out.write(node.value)
 
-def generate_block(node):
-    return ';'.join(generate(x) for x in node.body)
 
+@emitters.register(ListLiteral)
+def emit_list_literal(node, out, types):
+    out.write('[')
+    emit_joined(node.value, ',', out, types)
+    out.write(']')
 
-def generate_return(node):
-    return 'return %s' % generate(node.result)
 
+@emitters.register(Symbol)
+def emit_symbol(node, out, types):
+    out.write(node.name)
 
-def generate_literal(node):
-    return node.value
+@emitters.register(Import)
+def emit_import(node, out, types):
+    pass
 
+def mark(node, out):
+    mark = getattr(out, 'mark', None)
+    if mark:
+        mark(node)
 
-def generate_list_literal(node):
-    return '[%s]' % ','.join(generate(x) for x in node.value)
+def emit(node, out, types=None):
+    """
+    Writes the code for node to out, a text stream or anything else with a
+    write method. Streams with a mark method are told where each node
+    starts, to build source maps.
+    """
+    if types is None:
+        types = Inference(node)
 
+    mark(node, out)
+    emitters(node, out, types)
 
-def generate_symbol(node):
-    return node.name
+def generate(node, types=None):
+    out = io.StringIO()
+    emit(node, out, types)
+    return out.getvalue()
 
-def generate_import(node):
-    return ''
 
-def generate(node):
-    generators = {
-        Function: generate_function,
-        Invocation: generate_invocation,
-        Assignment: generate_assignment,
-        BinaryOperator: generate_binary_operator,
-        IfStatement: generate_if_statement,
-        Block: generate_block,
-        Return: generate_return,
-        StringLiteral: generate_literal,
-        NumericLiteral: generate_literal,
-        ListLiteral: generate_list_literal,
-        Symbol: generate_symbol,
-        Import: generate_import
-        }
+def emit_program(ast, out, types=None, optimize=False):
+    """
+    Writes the code for a module. With optimize, pure recursive functions
+    are turned into loops or memoized.
+    """
+    if types is None:
+        types = Inference(ast)
 
-    try:
-        return generators[type(node)](node)
-    except KeyError:
-        raise RuntimeError('unknown node: %r' % (node,))
+    for i, node in enumerate(ast.body):
+        if i:
+            out.write(';')
+
+        how = optimize and optimization(node, types)
+        if how == LOOP:
+            mark(node, out)
+            emit_loop_function(node, out, types)
+        elif how == MEMOIZE:
+            mark(node, out)
+            emit_memoized_function(node, out, types)
+        else:
+            emit(node, out, types)
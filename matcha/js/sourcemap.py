@@ -0,0 +1,138 @@
+"""
+Version 3 source maps for generated JavaScript.
+"""
+import json
+from bisect import bisect_right
+
+BASE64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+class Marker:
+    """
+    Records where nodes are emitted into out, a StringIO, and where they
+    start in text, the source they were parsed from, by their spans. Writes
+    go straight to out, emitters call mark(node) before writing a node.
+    """
+    def __init__(self, out, text, spans):
+        self.out = out
+        self.write = out.write
+        self.spans = spans
+        self.marks = []
+        self.lines = [0]
+        pos = text.find('\n')
+        while pos >= 0:
+            self.lines.append(pos + 1)
+            pos = text.find('\n', pos + 1)
+
+    def mark(self, node):
+        span = self.spans.get(node)
+        if span is None:
+            return
+
+        offset = self.out.tell()
+        if self.marks and self.marks[-1][0] == offset:
+            return
+
+        start = span[0]
+        line = bisect_right(self.lines, start) - 1
+        self.marks.append((offset, line, start - self.lines[line]))
+
+    def mappings(self):
+        """
+        The marks as (line, column, 0, source line, source column) tuples
+        counted from 0, for Writer.include.
+        """
+        output = self.out.getvalue()
+        out = []
+        line = line_start = 0
+        newline = output.find('\n')
+        for offset, source_line, source_column in self.marks:
+            while 0 <= newline < offset:
+                line += 1
+                line_start = newline + 1
+                newline = output.find('\n', line_start)
+
+            out.append(
+                (line, offset - line_start, 0, source_line, source_column))
+
+        return out
+
+
+class Writer:
+    """
+    Wraps a text stream, keeping track of the line and column the next
+    write lands on, to link the mappings of modules into a source map.
+    Mappings are (line, column, source, source line, source column) tuples
+    and source indexes sources.
+    """
+    def __init__(self, out):
+        self.out = out
+        self.line = 0
+        self.column = 0
+        self.mappings = []
+        self.sources = []
+
+    def write(self, text):
+        self.out.write(text)
+        newlines = text.count('\n')
+        if newlines:
+            self.line += newlines
+            self.column = len(text) - text.rfind('\n') - 1
+        else:
+            self.column += len(text)
+
+    def include(self, source, mappings):
+        """
+        Adds the mappings of code from source that is about to be written.
+        """
+        if source not in self.sources:
+            self.sources.append(source)
+        index = self.sources.index(source)
+
+        for line, column, _, source_line, source_column in mappings:
+            if line == 0:
+                column += self.column
+            self.mappings.append(
+                (line + self.line, column, index, source_line, source_column))
+
+
+def vlq(value):
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    out = ''
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            out += BASE64[digit | 32]
+        else:
+            return out + BASE64[digit]
+
+def encode(mappings):
+    lines = []
+    segments = []
+    line = column = source = source_line = source_column = 0
+    for mapping in sorted(mappings):
+        while line < mapping[0]:
+            lines.append(','.join(segments))
+            segments = []
+            line += 1
+            column = 0
+
+        segments.append(
+            vlq(mapping[1] - column) + vlq(mapping[2] - source) +
+            vlq(mapping[3] - source_line) + vlq(mapping[4] - source_column))
+        _, column, source, source_line, source_column = mapping
+
+    lines.append(','.join(segments))
+    return ';'.join(lines)
+
+def dumps(writer, file=None):
+    source_map = {
+        'version': 3,
+        'sources': writer.sources,
+        'names': [],
+        'mappings': encode(writer.mappings)
+        }
+    if file:
+        source_map['file'] = file
+
+    return json.dumps(source_map)
@@ -0,0 +1,153 @@
+import re
+from array import array
+
+NAME, NUMBER, STRING, NEWLINE, INDENT, DEDENT, ENDMARKER, ERRORTOKEN = range(8)
+
+tok_name = {
+    NAME: 'NAME',
+    NUMBER: 'NUMBER',
+    STRING: 'STRING',
+    NEWLINE: 'NEWLINE',
+    INDENT: 'INDENT',
+    DEDENT: 'DEDENT',
+    ENDMARKER: 'ENDMARKER',
+    ERRORTOKEN: 'ERRORTOKEN'
+    }
+
+OPERATORS = [
+    '==', '!=', '<=', '>=',
+    '+', '-', '*', '/', '>', '<', '=',
+    '(', ')', '[', ']', ',', '.', ':']
+
+KEYWORDS = ['def', 'if', 'return', 'import', 'and', 'or']
+
+# every operator and keyword gets its own kind, so matching one is a
+# single compare
+operator_kind = {}
+for i, op in enumerate(OPERATORS):
+    operator_kind[op] = ERRORTOKEN + 1 + i
+    tok_name[ERRORTOKEN + 1 + i] = op
+
+keyword_kind = {}
+for i, keyword in enumerate(KEYWORDS):
+    keyword_kind[keyword] = ERRORTOKEN + 1 + len(OPERATORS) + i
+    tok_name[keyword_kind[keyword]] = keyword
+
+token_regex = re.compile('|'.join([
+    r'(?P<space>[ \t\r\f]+)',
+    r'(?P<newline>\n)',
+    r'(?P<name>[a-zA-Z_]+[a-zA-Z_\d]*)',
+    r'(?P<number>\d+(\.\d*)?)',
+    r'(?P<string>"[^"\n]*"|\'[^\'\n]*\')',
+    '(?P<op>%s)' % '|'.join(map(re.escape, OPERATORS)),
+    r'(?P<error>.)']))
+
+group_kind = {'number': NUMBER, 'string': STRING,
+    'error': ERRORTOKEN}
+
+indentation = re.compile(' *')
+blank_line = re.compile(r'[ \t\r\f]*(\n|\Z)')
+
+class Tokens:
+    """
+    A token stream. Kinds and (start, end) offsets into text are held in
+    parallel arrays; token text is only sliced out when it is asked for.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+
+    def add(self, kind, start, end):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def value(self, i):
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        return zip(self.kinds, self.starts, self.ends)
+
+
+def tokenize(text):
+    """
+    Splits text into tokens in the spirit of Python's tokenize. NEWLINE ends
+    every non-blank line outside of brackets, INDENT and DEDENT surround
+    blocks and the stream always finishes with ENDMARKER.
+    """
+    tokens = Tokens(text)
+    kinds = tokens.kinds.append
+    starts = tokens.starts.append
+    ends = tokens.ends.append
+    match = token_regex.match
+    levels = [0]
+    depth = 0
+    line_start = True
+    pos = 0
+
+    while pos < len(text):
+        if line_start:
+            line_start = False
+            content = indentation.match(text, pos).end()
+            blank = blank_line.match(text, content)
+            if blank:
+                pos = blank.end()
+                line_start = True
+                continue
+
+            level = content - pos
+            while level < levels[-1]:
+                levels.pop()
+                tokens.add(DEDENT, pos, pos)
+
+            if level > levels[-1]:
+                levels.append(level)
+                tokens.add(INDENT, pos, content)
+
+            pos = content
+
+        m = match(text, pos)
+        kind = m.lastgroup
+        end = m.end()
+        if kind == 'space':
+            pass
+        elif kind == 'op':
+            op = m.group()
+            if op in '([':
+                depth += 1
+            elif op in ')]' and depth:
+                depth -= 1
+            kinds(operator_kind[op])
+            starts(pos)
+            ends(end)
+        elif kind == 'name':
+            kinds(keyword_kind.get(m.group(), NAME))
+            starts(pos)
+            ends(end)
+        elif kind == 'newline':
+            # lines continue inside brackets
+            if not depth:
+                kinds(NEWLINE)
+                starts(pos)
+                ends(end)
+                line_start = True
+        else:
+            kinds(group_kind[kind])
+            starts(pos)
+            ends(end)
+
+        pos = end
+
+    if len(tokens) and tokens.kinds[-1] not in (NEWLINE, DEDENT):
+        tokens.add(NEWLINE, len(text), len(text))
+
+    for _ in levels[1:]:
+        tokens.add(DEDENT, len(text), len(text))
+
+    tokens.add(ENDMARKER, len(text), len(text))
+    return tokens
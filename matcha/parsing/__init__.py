@@ -1,36 +1,46 @@
 import logging
+from functools import lru_cache
 
 from ..ast import (
     Assignment, BinaryOperator, Block, Function, IfStatement, Import,
     Invocation, ListLiteral, NumericLiteral, Return, StringLiteral,
     Symbol)
+from ..lexing import (
+    DEDENT, INDENT, NAME, NEWLINE, NUMBER, STRING, keyword_kind,
+    operator_kind)
 from .base import (
-    ParsingException, either, flat, joined, joined_skip, many, match, oneof,
-    p_regex, rstrip, strip, then, then_all, wrapped)
+    Combinator, Forward, ParsingException, Source, cursor, either, first,
+    flat, infix, joined, joined_skip, many, match, oneof, packrat, then,
+    then_all, token, wrapped)
 
 log = logging.getLogger(__name__)
 
 def trace(p):
-    def t(text):
+    parse = cursor(p)
+
+    def t(source, pos):
+        text = source.rest(pos)
         print('>>>>>', text.replace(' ','[ ]').replace('\n','\\n'))
-        return p(text)
+        return parse(source, pos)
 
-    return t
+    return Combinator(t)
 
 def dbg(p):
     return p
 
-class Parser:
+class Parser(Combinator):
     def __init__(self, func, node):
         self.func = func
         self.node = node
+        self.inner = cursor(func)
+        self.first = first(func)
 
-    def __call__(self, *args):
+    def parse(self, source, pos):
         try:
-            result = self.func(*args)
+            result = self.inner(source, pos)
         except ParsingException as e:
-            log.error('syntax error, expected %s, got: %s' %
-                (e.expected, e.rest))
+            log.error('syntax error at %d:%d, expected %s, got: %s' %
+                (e.source.location(e.pos) + (e.expected, e.rest)))
             log.error('parser is: %s', e.parser)
             return None
 
@@ -39,177 +49,292 @@ class Parser:
             return None
 
         if type(result[0]) == dict:
-            return self.node(**result[0]), result[1]
-
-        return self.node(result[0]), result[1]
-
-
-def empty_line():
-    return p_regex('\\s*\n')
-
-def symbol():
-    return rstrip(p_regex('[a-zA-Z_]+[a-zA-Z_\\d]*'))
-
-def free_symbol():
-    return strip(p_regex('[a-zA-Z_]+[a-zA-Z_\\d]*'))
-
-def dotted_name():
-    return Parser(
-        flat(joined(match('.'), symbol())),
-        Symbol)
-
-def string_literal():
-    return either(p_regex('".*?"'), p_regex("'.*?'"))
-
-def numeric_literal():
-    return p_regex(r'\d+(\.\d*)?')
-
-def list_literal():
-    return wrapped(
-        match('['),
-        joined_skip(match(','), strip(expression())),
-        match(']'))
-
-def literal():
-    return either(
-            Parser(string_literal(), StringLiteral),
-            Parser(numeric_literal(), NumericLiteral),
-            Parser(list_literal(), ListLiteral))
-
-def atom():
-    return rstrip(either(dotted_name(), literal()))
-
-def free_atom():
-    return strip(either(dotted_name(), literal()))
-
-def indent(p):
-    def indent_parser(text):
-        split = text.split('\n')
-        matched = []
-        for i in range(len(split)):
-            line = split[i]
-            if line.startswith('    '):
-                matched.append(line[4:])
-            elif line:
-                # stop on the first non-empty line that's
-                # not properly indented
-                i -= 1
-                break
-
-        rest = '\n'.join(split[i+1:])
-        if matched:
-            r = p('\n'.join(matched))
-            return r[0], r[1] + rest
-
-        return None
-
-    return indent_parser
-
-def arguments():
-    return wrapped(
-        match('('),
-        joined_skip(match(','), free_symbol()),
-        match(')'))
-
-def invocation_arguments():
-    return wrapped(
-        match('('),
-        joined_skip(match(','), strip(expression())),
-        match(')'))
-
-def invocation():
-    return Parser(then(
-        'func', dotted_name(),
-        'args', invocation_arguments()), Invocation)
-
-def placeholder(f, z):
-    memo = {}
-    def load(*args):
-        return memo.setdefault((f,z), f(*z))(*args)
-
-    return load
-
-def memoize(f):
-    def helper(*args):
-        return placeholder(f, args)
-    return helper
+            node = self.node(**result[0])
+        else:
+            node = self.node(result[0])
+
+        end = result[1]
+        source.recorded[id(node)] = pos << 32 | end
+        return node, end
+
 
-@memoize
-def binary_operator():
-    return Parser(then(
-        'first', either(invocation(), atom()),
-        'operator', strip(oneof([
-            '+','-','*','/',
-            '==','!=', '>', '<'])),
-        'second', expression()), BinaryOperator)
-
-@memoize
-def expression():
-    return either(
-        binary_operator(),
-        invocation(),
-        atom())
-
-
-def end_def():
-    return match(':\n')
-
-def if_statement():
-    return Parser(then(
-        '_', match('if '),
-        'expression', expression(),
-        '_', end_def(),
-        'body', block()), IfStatement)
-
-def assignment():
-    return Parser(then(
-        'dst', Parser(symbol(), Symbol),
-        '_', rstrip(match('=')),
-        'src', atom()), Assignment)
-
-def return_statement():
-    return Parser(then(
-        '_', match('return '),
-        'result', expression()), Return)
-
-@memoize
-def statement():
-    return either(invocation(), assignment(),
-        if_statement(), return_statement())
-
-
-def block():
-    return Parser(
-        then(
-            'body', indent(many(
-                rstrip(statement()))))
-        , Block)
-
-def function(level):
-    return Parser(then_all(
-            '_', match('def '),
-            'name', symbol(),
-            'args', arguments(),
-            '_', end_def(),
-            'body', block()), Function)
-
-def import_():
-    return Parser(
-        then_all(
-            '_', match('import '),
-            'name', dotted_name()), Import)
+def profiled(name, p, profile):
+    """
+    Reports every time p is tried, and whether it matched, to profile.
+    """
+    parse = cursor(p)
+
+    def profiled_parser(source, pos):
+        r = None
+        try:
+            r = parse(source, pos)
+        finally:
+            profile.rule(name, r is not None)
+        return r
+
+    return Combinator(profiled_parser, first(p))
+
+def rule(f):
+    """
+    Builds a grammar rule at most once per grammar. While a rule is being
+    built, references to it get a forward declaration so recursive rules
+    terminate. Rules run over tokens. In a grammar built for a profile,
+    rules report to it.
+    """
+    name = f.__name__
+    def helper(self):
+        rules = self.rules
+        if name not in rules:
+            forward = rules[name] = Forward()
+            built = rules[name] = f(self)
+            if self.profile:
+                built = rules[name] = profiled(name, built, self.profile)
+            built.lexed = True
+            forward.define(built)
+
+        return rules[name]
+
+    helper.__name__ = name
+    return helper
 
+def op(*operators):
+    return token(*[operator_kind[o] for o in operators])
+
+def keyword(name):
+    return token(keyword_kind[name])
+
+# binding strength of binary operators, all are left associative
+PRECEDENCE = {
+    'or': 1,
+    'and': 2,
+    '==': 3, '!=': 3, '<': 3, '>': 3, '<=': 3, '>=': 3,
+    '+': 4, '-': 4,
+    '*': 5, '/': 5,
+    }
+
+def binary(first, operator, second, source):
+    recorded = source.recorded
+    node = BinaryOperator(first, operator, second)
+    # from the start of first to the end of second
+    recorded[id(node)] = (recorded[id(first)] & ~0xffffffff |
+                          recorded[id(second)] & 0xffffffff)
+    return node
+
+operator_precedence = {}
+for o, precedence in PRECEDENCE.items():
+    kind = operator_kind.get(o) or keyword_kind[o]
+    operator_precedence[kind] = precedence
+
+
+class Grammar:
+    """
+    All rules of the language, built once and shared by every parse.
+    Profiled parses use a grammar of their own, built for the profile.
+    """
+    def __init__(self, profile=None):
+        self.rules = {}
+        self.profile = profile
+        self.program()
+
+    def parse(self, source):
+        return self.program().run(source)
+
+    @rule
+    def newline(self):
+        return token(NEWLINE)
+
+    @rule
+    def symbol(self):
+        return token(NAME)
+
+    @rule
+    def dotted_name(self):
+        return Parser(
+            flat(joined(op('.'), self.symbol())),
+            Symbol)
+
+    @rule
+    def string_literal(self):
+        return token(STRING)
+
+    @rule
+    def numeric_literal(self):
+        return token(NUMBER)
+
+    @rule
+    def list_literal(self):
+        return wrapped(
+            op('['),
+            joined_skip(op(','), self.expression()),
+            op(']'))
+
+    @rule
+    def literal(self):
+        return either(
+                Parser(self.string_literal(), StringLiteral),
+                Parser(self.numeric_literal(), NumericLiteral),
+                Parser(self.list_literal(), ListLiteral))
+
+    @rule
+    def atom(self):
+        return packrat(either(self.dotted_name(), self.literal()))
+
+    @rule
+    def arguments(self):
+        return wrapped(
+            op('('),
+            joined_skip(op(','), self.symbol()),
+            op(')'))
+
+    @rule
+    def invocation_arguments(self):
+        return wrapped(
+            op('('),
+            joined_skip(op(','), self.expression()),
+            op(')'))
+
+    @rule
+    def invocation(self):
+        return packrat(Parser(then(
+            'func', self.dotted_name(),
+            'args', self.invocation_arguments()), Invocation))
+
+    @rule
+    def operand(self):
+        return either(
+            self.invocation(),
+            self.atom(),
+            wrapped(op('('), self.expression(), op(')')))
+
+    @rule
+    def binary_operator(self):
+        return packrat(infix(
+            self.operand(), operator_precedence, binary,
+            required=True))
+
+    @rule
+    def expression(self):
+        return packrat(infix(
+            self.operand(), operator_precedence, binary))
+
+    @rule
+    def end_def(self):
+        return then('_', op(':'), '_', self.newline())
+
+    @rule
+    def if_statement(self):
+        return Parser(then(
+            '_', keyword('if'),
+            'expression', self.expression(),
+            '_', self.end_def(),
+            'body', self.block()), IfStatement)
+
+    @rule
+    def assignment(self):
+        return Parser(then(
+            'dst', Parser(self.symbol(), Symbol),
+            '_', op('='),
+            'src', self.atom()), Assignment)
+
+    @rule
+    def return_statement(self):
+        return Parser(then(
+            '_', keyword('return'),
+            'result', self.expression()), Return)
+
+    @rule
+    def statement(self):
+        return packrat(either(self.invocation(), self.assignment(),
+            self.if_statement(), self.return_statement()))
+
+    @rule
+    def line(self):
+        # simple statements end with a newline, compound ones with a dedent
+        return either(
+            wrapped(None, either(
+                self.invocation(), self.assignment(), self.return_statement()),
+                self.newline()),
+            self.if_statement())
+
+    @rule
+    def block(self):
+        return Parser(
+            then(
+                '_', token(INDENT),
+                'body', many(self.line()),
+                '_', token(DEDENT))
+            , Block)
+
+    @rule
+    def function(self):
+        return Parser(then_all(
+                '_', keyword('def'),
+                'name', self.symbol(),
+                'args', self.arguments(),
+                '_', self.end_def(),
+                'body', self.block()), Function)
+
+    @rule
+    def import_(self):
+        return Parser(
+            then_all(
+                '_', keyword('import'),
+                'name', self.dotted_name(),
+                '_', self.newline()), Import)
+
+    @rule
+    def definition(self):
+        return either(self.function())
+
+    @rule
+    def program(self):
+        return Parser(
+            then(
+                'body',
+                many(either(
+                    self.import_(),
+                    self.definition(),
+                    self.line()))),
+            Block)
+
+
+@lru_cache(maxsize=None)
+def grammar():
+    return Grammar()
+
+def shared(name):
+    def accessor():
+        return getattr(grammar(), name)()
+
+    accessor.__name__ = name
+    return accessor
+
+newline = shared('newline')
+symbol = shared('symbol')
+dotted_name = shared('dotted_name')
+string_literal = shared('string_literal')
+numeric_literal = shared('numeric_literal')
+list_literal = shared('list_literal')
+literal = shared('literal')
+atom = shared('atom')
+arguments = shared('arguments')
+invocation_arguments = shared('invocation_arguments')
+invocation = shared('invocation')
+operand = shared('operand')
+binary_operator = shared('binary_operator')
+expression = shared('expression')
+end_def = shared('end_def')
+if_statement = shared('if_statement')
+assignment = shared('assignment')
+return_statement = shared('return_statement')
+statement = shared('statement')
+line = shared('line')
+block = shared('block')
+import_ = shared('import_')
+program = shared('program')
+
+def function(level=0):
+    return grammar().function()
 
 def definition(level=0):
-    return either(function(level))
-
-def program():
-    return Parser(
-        then(
-            'body',
-            many(rstrip(either(
-                empty_line(),
-                import_(),
-                definition(),
-                statement())))),
-        Block)
+    return grammar().definition()
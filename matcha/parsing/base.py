@@ -1,46 +1,203 @@
 import re
 import logging
+from array import array
 from functools import partial
 
+from ..ast import Spans, walk
+from ..lexing import tokenize
+
 log = logging.getLogger(__name__)
 
 class ParsingException(Exception):
-    def __init__(self, expected, parser, rest):
+    def __init__(self, expected, parser, source, pos):
         self.expected = expected
         self.parser = parser
-        self.rest = rest
+        self.source = source
+        self.pos = pos
+
+    @property
+    def rest(self):
+        return self.source.rest(self.pos)
+
+class Source:
+    """
+    Input of a single parse. Positions are offsets into text, or indices
+    into the token stream when the source is lexed. With packrat enabled,
+    results of rules wrapped in packrat() are memoized per position until
+    the parse ends. Nodes are recorded with the positions they were parsed
+    from, spans() turns those into the Spans of the tree parsed.
+    """
+    def __init__(self, text, packrat=False, lexed=False):
+        self.text = text
+        self.tokens = tokenize(text) if lexed else None
+        self.memo = {} if packrat else None
+        # start and end position of every node built, packed into one int
+        # by id. A node that was dropped may leave its entry behind, but
+        # the id is only reused by a node built later, which then records
+        # its own
+        self.recorded = {}
+        self.hits = 0
+        self.misses = 0
+
+    def offset(self, pos):
+        if self.tokens is None:
+            return pos
+        return self.tokens.starts[pos]
+
+    def rest(self, pos):
+        return self.text[self.offset(pos):]
+
+    def spans(self, tree):
+        """
+        The Spans of tree, parsed from this source.
+        """
+        recorded = self.recorded
+        packed = [recorded.get(id(node), -1) for node in walk(tree)]
+
+        # offsets of the first and last character at each position
+        if self.tokens is None:
+            firsts = range(len(self.text) + 1)
+            lasts = range(1, len(self.text) + 2)
+        else:
+            firsts = self.tokens.starts
+            lasts = self.tokens.ends
+
+        mask = 0xffffffff
+        starts = array('i', [
+            -1 if span < 0 else firsts[span >> 32] for span in packed])
+        # nodes matching no input end where they start
+        ends = array('i', [
+            -1 if span < 0 else
+            lasts[(span & mask) - 1] if span & mask > span >> 32 else
+            firsts[span >> 32]
+            for span in packed])
+
+        return Spans(tree, starts, ends)
+
+    def location(self, pos):
+        offset = self.offset(pos)
+        line = self.text.count('\n', 0, offset) + 1
+        return line, offset - self.text.rfind('\n', 0, offset)
+
+class Combinator:
+    """
+    Wraps a cursor parser, a function of (source, pos) that returns
+    (value, new_pos) or None. Calling the combinator with a string keeps
+    the old (value, rest) interface; lexed combinators are then run over
+    the tokens of that string.
+    """
+    lexed = False
+    # kinds of token the parser can start with, None when unknown
+    first = None
+
+    def __init__(self, parse, first=None):
+        self.parse = parse
+        self.first = first
+
+    def run(self, source):
+        try:
+            r = self.parse(source, 0)
+        finally:
+            if source.memo is not None:
+                source.memo = {}
+
+        if r:
+            return r[0], source.rest(r[1])
+        return None
+
+    def __call__(self, text):
+        return self.run(Source(text, lexed=self.lexed))
+
+def first(p):
+    return getattr(p, 'first', None)
+
+def cursor(p):
+    if isinstance(p, Combinator):
+        return p.parse
+
+    # plain (value, rest) functions only see the remaining text
+    def text_parser(source, pos):
+        text = source.text
+        r = p(text[pos:])
+        if r:
+            return r[0], len(text) - len(r[1])
+        return None
+
+    return text_parser
+
+class Forward(Combinator):
+    """
+    Stands in for a parser that is defined later, to build recursive rules.
+    """
+    def __init__(self):
+        self.inner = None
 
-def p_match(s, text):
-    if text.startswith(s):
-        return s, text[len(s):]
+    def define(self, p):
+        self.inner = cursor(p)
+
+    def parse(self, source, pos):
+        return self.inner(source, pos)
+
+def packrat(p):
+    parse = cursor(p)
+
+    def packrat_parser(source, pos):
+        memo = source.memo
+        if memo is None:
+            return parse(source, pos)
+
+        k = (parse, pos)
+        if k in memo:
+            source.hits += 1
+            return memo[k]
+
+        source.misses += 1
+        r = memo[k] = parse(source, pos)
+        return r
+
+    return Combinator(packrat_parser, first(p))
+
+def p_match(s, source, pos):
+    if source.text.startswith(s, pos):
+        return s, pos + len(s)
     return None
 
 def p_regex(regex):
-    def regex_parser(text):
-        m = re.compile(regex).match(text)
+    pattern = re.compile(regex)
+
+    def regex_parser(source, pos):
+        m = pattern.match(source.text, pos)
         if m:
-            g = m.group()
-            return g, text[len(g):]
+            return m.group(), m.end()
 
         return None
 
-    return regex_parser
+    return Combinator(regex_parser)
 
 def match(s):
-    return partial(p_match, s)
+    return Combinator(partial(p_match, s))
+
+def p_token(kinds, source, pos):
+    tokens = source.tokens
+    if tokens.kinds[pos] in kinds:
+        return source.text[tokens.starts[pos]:tokens.ends[pos]], pos + 1
+
+    return None
 
-def then_parser(spec, match_all, text):
+def token(*kinds):
+    kinds = frozenset(kinds)
+    return Combinator(partial(p_token, kinds), kinds)
+
+def then_parser(spec, parsers, match_all, source, pos):
     names = spec[::2]
-    parsers = spec[1::2]
-    t = text
     out = {}
     for i in range(len(names)):
-        p = parsers[i]
         n = names[i]
-        r = p(t)
+        r = parsers[i](source, pos)
         if r == None:
-            if match_all:
-                raise ParsingException(n, p, t)
+            # commit only once the leading element has matched
+            if match_all and i > 0:
+                raise ParsingException(n, spec[i * 2 + 1], source, pos)
 
             return None
 
@@ -49,41 +206,68 @@ def then_parser(spec, match_all, text):
         elif n != '_':
             out[n] = r[0]
 
-        t = r[1]
+        pos = r[1]
 
-    return out, t
+    return out, pos
 
 def then(*spec):
-    return partial(then_parser, spec, False)
+    parsers = [cursor(p) for p in spec[1::2]]
+    return Combinator(partial(then_parser, spec, parsers, False),
+        first(spec[1]))
 
 def then_all(*spec):
-    return partial(then_parser, spec, True)
+    parsers = [cursor(p) for p in spec[1::2]]
+    return Combinator(partial(then_parser, spec, parsers, True),
+        first(spec[1]))
 
 def many(p):
-    def many_parser(text):
+    parse = cursor(p)
+
+    def many_parser(source, pos):
         out = []
-        r = p(text)
+        r = parse(source, pos)
         while r:
             out.append(r[0])
-            text = r[1]
-            r = p(text)
+            pos = r[1]
+            r = parse(source, pos)
 
         if out:
-            return out, text
+            return out, pos
         return None
 
-    return many_parser
+    return Combinator(many_parser, first(p))
 
 def either(*parsers):
-    def either_parser(text):
+    firsts = [first(p) for p in parsers]
+    parsers = [cursor(p) for p in parsers]
+
+    def either_parser(source, pos):
         for p in parsers:
-            r = p(text)
+            r = p(source, pos)
+            if r:
+                return r
+
+        return None
+
+    if None in firsts:
+        return Combinator(either_parser)
+
+    # over tokens, only try the alternatives that can start with the
+    # current token
+    kinds = frozenset().union(*firsts)
+    table = {}
+    for kind in kinds:
+        table[kind] = [p for p, f in zip(parsers, firsts) if kind in f]
+
+    def dispatch_parser(source, pos):
+        for p in table.get(source.tokens.kinds[pos], ()):
+            r = p(source, pos)
             if r:
                 return r
 
         return None
 
-    return either_parser
+    return Combinator(dispatch_parser, kinds)
 
 def oneof(options):
     return either(*map(match, options))
@@ -95,31 +279,37 @@ def wrapped(pre, p, post):
     if post:
         spec = spec + ['_', post]
 
-    t = then(*spec)
+    t = then(*spec).parse
 
-    def wrapped_parser(text):
-        r = t(text)
+    def wrapped_parser(source, pos):
+        r = t(source, pos)
         if r:
             return r[0]['inner'], r[1]
         return None
 
-    return wrapped_parser
+    return Combinator(wrapped_parser, first(spec[1]))
+
+whitespace = p_regex('\\s*')
 
 def rstrip(p):
-    return wrapped(None, p, p_regex('\\s*'))
+    return wrapped(None, p, whitespace)
 
 def strip(p):
-    return wrapped(p_regex('\\s*'), p, p_regex('\\s*'))
+    return wrapped(whitespace, p, whitespace)
 
 def joined(by, part):
-    def joined_parser(text):
+    kinds = first(part)
+    by = cursor(by)
+    part = cursor(part)
+
+    def joined_parser(source, pos):
         out = []
-        r = part(text)
+        r = part(source, pos)
         expect = by
         while r:
             out.append(r[0])
-            text = r[1]
-            r = expect(text)
+            pos = r[1]
+            r = expect(source, pos)
             if not r:
                 break
 
@@ -127,31 +317,86 @@ def joined(by, part):
 
         if out:
             if expect == part:
-                return out[:-1], text
-            return out, text
+                return out[:-1], pos
+            return out, pos
         return None
 
-    return joined_parser
+    return Combinator(joined_parser, kinds)
 
 def joined_skip(by, part, empty_valid=True):
-    def joined_skip_parser(text):
-        r = joined(by, part)(text)
+    joined_combinator = joined(by, part)
+    joined_parse = joined_combinator.parse
+
+    def joined_skip_parser(source, pos):
+        r = joined_parse(source, pos)
         if r:
             return r[0][::2], r[1]
 
         if empty_valid:
-            return [], text
+            return [], pos
         return None
-    return joined_skip_parser
+
+    if empty_valid:
+        return Combinator(joined_skip_parser)
+    return Combinator(joined_skip_parser, joined_combinator.first)
 
 def flat(p):
-    def flat_parser(text):
-        r = p(text)
+    parse = cursor(p)
+
+    def flat_parser(source, pos):
+        r = parse(source, pos)
         if r:
             return ''.join(r[0]), r[1]
         return None
 
-    return flat_parser
+    return Combinator(flat_parser, first(p))
+
+def infix(operand, operators, combine, required=False):
+    """
+    Parses operands separated by binary operators over tokens, binding by
+    precedence climbing with explicit stacks so chains of any length parse
+    in linear time without recursion. operators maps an operator's token
+    kind to its precedence, all operators are left associative and
+    combine(first, operator, second, source) builds each node. If
+    required, at least one operator has to be present.
+    """
+    parse = cursor(operand)
+
+    def reduce(values, ops, source):
+        second = values.pop()
+        values.append(combine(values.pop(), ops.pop()[1], second, source))
+
+    def infix_parser(source, pos):
+        r = parse(source, pos)
+        if not r:
+            return None
+
+        tokens = source.tokens
+        kinds = tokens.kinds
+        values = [r[0]]
+        ops = []
+        pos = r[1]
+        applied = False
+        while kinds[pos] in operators:
+            r = parse(source, pos + 1)
+            if not r:
+                break
+
+            precedence = operators[kinds[pos]]
+            while ops and ops[-1][0] >= precedence:
+                reduce(values, ops, source)
+
+            ops.append((precedence, tokens.value(pos)))
+            values.append(r[0])
+            pos = r[1]
+            applied = True
+
+        if required and not applied:
+            return None
 
+        while ops:
+            reduce(values, ops, source)
 
+        return values[0], pos
 
+    return Combinator(infix_parser, first(operand))
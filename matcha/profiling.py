@@ -0,0 +1,142 @@
+"""
+Profiling of compiles. While a Profile is active, the compiler reports
+the phases it goes through and a grammar built for the profile reports
+every rule it tries. The profile records per stack of phases how often
+it ran, its wall time and optionally the memory it allocated, and per
+grammar rule how often it was tried and how often it failed so the
+parser had to backtrack.
+
+    profile = profiling.start()
+    compile_source(text, 'Program', 'js')
+    profiling.stop().dump(sys.stdout)
+
+Subclasses can override enter, exit and rule to hook into the compiler.
+Without an active profile, phase() returns a shared object that does
+nothing, and grammar rules are not wrapped.
+"""
+import json
+import time
+
+active = None
+
+
+class Nothing:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+NOTHING = Nothing()
+
+
+class Phase:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.enter(self.name)
+
+    def __exit__(self, *exc):
+        self.profile.exit(self.name)
+
+
+class Profile:
+    """
+    Calls, seconds and bytes allocated by stack of phase names, and tried
+    and failed counts by grammar rule. Memory is traced with tracemalloc,
+    which slows the compile down, so only when memory is set.
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.phases = {}
+        self.rules = {}
+        self.stack = []
+
+    def allocated(self):
+        if not self.memory:
+            return 0
+
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return tracemalloc.get_traced_memory()[0]
+
+    def enter(self, name):
+        self.stack.append((name, time.perf_counter(), self.allocated()))
+
+    def exit(self, name):
+        _, start, memory = self.stack[-1]
+        path = tuple(n for n, _, _ in self.stack)
+        self.stack.pop()
+
+        stats = self.phases.setdefault(path, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+        stats[2] += self.allocated() - memory
+
+    def rule(self, name, matched):
+        stats = self.rules.setdefault(name, [0, 0])
+        stats[0] += 1
+        if not matched:
+            stats[1] += 1
+
+    def to_json(self):
+        return {
+            'phases': [
+                {'stack': list(path), 'calls': calls, 'seconds': seconds,
+                 'memory': memory}
+                for path, (calls, seconds, memory)
+                in sorted(self.phases.items())],
+            'rules': {
+                name: {'tried': tried, 'backtracked': failed}
+                for name, (tried, failed) in sorted(self.rules.items())}
+            }
+
+    def folded(self):
+        """
+        Lines of ';' separated stacks and the microseconds spent in each
+        stack itself, the input flamegraph.pl and speedscope take.
+        """
+        own = {path: stats[1] for path, stats in self.phases.items()}
+        for path, stats in self.phases.items():
+            if path[:-1] in own:
+                own[path[:-1]] -= stats[1]
+
+        return ['%s %d' % (';'.join(path), max(0, seconds) * 1e6)
+                for path, seconds in sorted(own.items())]
+
+    def dump(self, f, format='json'):
+        if format == 'json':
+            json.dump(self.to_json(), f, indent=2)
+            f.write('\n')
+        else:
+            for line in self.folded():
+                f.write(line + '\n')
+
+
+def start(profile=None):
+    """
+    Makes profile, or a new Profile, the active one and returns it.
+    """
+    global active
+    active = profile or Profile()
+    return active
+
+def stop():
+    """
+    Deactivates the active profile and returns it.
+    """
+    global active
+    profile, active = active, None
+    return profile
+
+def phase(name):
+    """
+    Context manager that records the code it wraps as the named phase of
+    the active profile.
+    """
+    if active is None:
+        return NOTHING
+    return Phase(active, name)
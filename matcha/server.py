@@ -0,0 +1,218 @@
+"""
+Compile server. Worker processes keep the grammar built and the modules
+they compiled in memory, so a job only pays for what changed. Jobs are
+JSON lines read from a Unix socket or stdin:
+
+    {"id": 1, "language": "js", "filename": "/abs/program.tea",
+     "cwd": "/abs", "optimize": false, "env": {"MATCHA_LIB": "/abs/std"}}
+
+with "source" holding the program instead of "filename" for programs
+that are not in a file. With "env", the job is compiled with MATCHA_LIB
+and the cache settings of the client, unset when missing from it. Each
+job is answered with a JSON line carrying the same id and the linked
+program as "output", or an "error" with the errors logged while
+compiling. Replies are written as jobs finish, not in the order they
+came in.
+"""
+import io
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .build import ModuleGraph, build, changed, compile_source
+from .cache import open_cache
+from .client import ENVIRONMENT
+from .parsing import grammar
+
+log = logging.getLogger(__name__)
+
+# state of a worker process: the module graph of each kind of build with
+# the stamps of the files it was last built from, and the last compile of
+# each program
+graphs = {}
+programs = {}
+
+
+def compile_job(job):
+    """
+    Compiles and links the program of a job, returning its code. Runs in
+    a worker process, in the job's working directory.
+    """
+    language = job['language']
+    optimize = job.get('optimize', False)
+    filename = job.get('filename')
+    if filename:
+        with open(filename) as f:
+            text = f.read()
+    else:
+        text = job['source']
+
+    parent_path = os.path.dirname(filename or '')
+    key = (language, optimize, os.getcwd(), parent_path,
+           os.getenv('MATCHA_LIB'))
+    if key not in graphs:
+        graphs[key] = ModuleGraph(language, optimize=optimize), {}
+    # each graph has stamps of its own, a file another graph has seen
+    # changed may still be stale in this one
+    graph, stamps = graphs[key]
+
+    files = [m.filename for m in graph.modules.values()]
+    modified = changed(files, stamps)
+    graph.discard([m.name for m in list(graph.modules.values())
+                   if m.filename in modified])
+
+    program = key + (filename,)
+    if program in programs and programs[program][0] == text:
+        _, ast, output = programs[program]
+    else:
+        ast, output = compile_source(
+            text, 'Program', language, is_main=True, cache=open_cache(),
+            optimize=optimize)
+        if not ast:
+            raise RuntimeError('failed compiling program')
+        programs[program] = text, ast, output
+
+    out = io.StringIO()
+    if not build(out, graph, ast, output, parent_path, language):
+        raise RuntimeError('failed compiling modules')
+
+    # modules compiled by this job are up to date
+    changed([m.filename for m in graph.modules.values()], stamps)
+    return out.getvalue()
+
+def set_environment(env):
+    for name in ENVIRONMENT:
+        if env.get(name) is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = env[name]
+
+class Errors(logging.Handler):
+    """
+    Collects the errors logged by the compiler in the current thread.
+    """
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.thread = threading.get_ident()
+        self.messages = []
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.messages.append(record.getMessage())
+
+def run(job):
+    """
+    Answers a job, errors included.
+    """
+    start = time.perf_counter()
+    reply = {'id': job.get('id')}
+
+    errors = Errors()
+    logger = logging.getLogger('matcha')
+    logger.addHandler(errors)
+
+    env = job.get('env')
+    saved = {name: os.environ.get(name) for name in ENVIRONMENT}
+    try:
+        if env is not None:
+            set_environment(env)
+        os.chdir(job.get('cwd') or os.getcwd())
+        reply['output'] = compile_job(job)
+    except Exception as e:
+        reply['error'] = '\n'.join(errors.messages + [str(e)])
+    finally:
+        logger.removeHandler(errors)
+        set_environment(saved)
+
+    log.info('job %s %s in %.1f ms', reply['id'],
+             'failed' if 'error' in reply else 'compiled',
+             (time.perf_counter() - start) * 1000)
+    return reply
+
+def warm():
+    grammar()
+
+
+def serve_lines(lines, write, executor):
+    """
+    Submits every job in lines, an iterable of JSON lines, to executor and
+    writes each reply with write as soon as it is ready. Returns when all
+    jobs are answered.
+    """
+    lock = threading.Lock()
+    pending = []
+
+    def reply(value):
+        with lock:
+            write(json.dumps(value) + '\n')
+
+    for line in lines:
+        if not line.strip():
+            continue
+
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            reply({'id': None, 'error': 'invalid job: %s' % e})
+            continue
+
+        written = threading.Event()
+        pending.append(written)
+
+        def done(future, written=written):
+            try:
+                reply(future.result())
+            finally:
+                written.set()
+
+        executor.submit(run, job).add_done_callback(done)
+
+    # callbacks run after the future is done, wait for the replies instead
+    for written in pending:
+        written.wait()
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        def write(text):
+            self.wfile.write(text.encode())
+
+        lines = (line.decode() for line in self.rfile)
+        serve_lines(lines, write, self.server.executor)
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(jobs=1, path=None):
+    """
+    Serves jobs on the Unix socket at path, or on stdin and stdout.
+    """
+    executor = ProcessPoolExecutor(jobs, initializer=warm)
+    if not path:
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+        serve_lines(sys.stdin, write, executor)
+        executor.shutdown()
+        return
+
+    if os.path.exists(path):
+        os.unlink(path)
+
+    server = Server(path, Handler)
+    server.executor = executor
+    log.info('serving on %s with %d workers', path, jobs)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+        executor.shutdown()
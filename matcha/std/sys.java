@@ -7,7 +7,17 @@ public class sys {
     public static void log(Object... msgs) {
         System.out.println(String.join(" ",
             Arrays.asList(msgs)
-            .stream().map(x -> { return x.toString(); })
+            .stream().map(sys::show)
             .collect(Collectors.toList())));
     }
+
+    private static String show(Object x) {
+        if (x instanceof int[]) {
+            return Arrays.toString((int[]) x);
+        }
+        if (x instanceof double[]) {
+            return Arrays.toString((double[]) x);
+        }
+        return x.toString();
+    }
 }
@@ -1,2 +1,7 @@
 from .ast import *
 from .parsing import *
+from .lexing import *
+from .cache import *
+from .build import *
+from .server import *
+from .profiling import *
@@ -1,10 +1,21 @@
+import pickle
+import struct
+import sys
+import tempfile
+
 from nose.tools import eq_, raises
 
-from matcha.ast import StringLiteral, NumericLiteral, Return, BinaryOperator, Symbol
+from matcha.ast import (StringLiteral, NumericLiteral, Return, BinaryOperator,
+    Symbol, Assignment, Block, IfStatement, ListLiteral, Function, Invocation)
 from matcha.ast.inference import (Types, infer_numeric_literal, infer_string_literal,
     infer_return, infer_function, infer_binary_operator, InferenceError, SymbolType,
-    resolve_types)
-from matcha.parsing import function
+    resolve_types, infer_assignment, Inference, infer_list, ListType)
+from matcha.ast import serialize
+from matcha.ast.dispatch import Dispatch
+from matcha.ast.fold import fold
+from matcha.ast.purity import LOOP, MEMOIZE, analyze, optimization
+from matcha.parsing import function, program
+from matcha.parsing.base import Source
 
 
 def test_infer_literal():
@@ -74,6 +85,44 @@ def test_resolve_types_fail():
 
     eq_(resolve_types(constrains), None)
 
+def test_resolve_types_chain():
+    constrains = [
+        (SymbolType('a'), SymbolType('b')),
+        (SymbolType('b'), SymbolType('c')),
+        (SymbolType('c'), Types.Integer),
+        (SymbolType('d'), SymbolType('e')),
+        ]
+
+    eq_(resolve_types(constrains), {
+        SymbolType('a'): Types.Integer,
+        SymbolType('b'): Types.Integer,
+        SymbolType('c'): Types.Integer,
+        })
+
+def test_resolve_types_clash():
+    constrains = [
+        (SymbolType('a'), Types.Integer),
+        (SymbolType('b'), Types.String),
+        (SymbolType('a'), SymbolType('b')),
+        ]
+
+    try:
+        resolve_types(constrains)
+    except InferenceError as e:
+        assert 'Types.Integer' in str(e)
+        assert 'Types.String' in str(e)
+    else:
+        assert False, 'expected InferenceError'
+
+def test_resolve_types_long_chain():
+    symbols = [SymbolType('x%d' % i) for i in range(100000)]
+    constrains = list(zip(symbols, symbols[1:]))
+    constrains.append((symbols[-1], Types.Double))
+
+    solution = resolve_types(constrains)
+    eq_(len(solution), len(symbols))
+    eq_(solution[symbols[0]], Types.Double)
+
 def test_infer_argument():
     func, _ = function(0)(
         'def double(x):\n'
@@ -83,3 +132,233 @@ def test_infer_argument():
     eq_(ret, SymbolType('x'))
     eq_(constrains, {(SymbolType('x'), Types.Integer)})
 
+
+def test_infer_assignment():
+    assignment = Assignment(NumericLiteral('2'), Symbol('x'))
+
+    eq_(infer_assignment(assignment),
+        (Types.Integer, {(Types.Integer, SymbolType('x'))}))
+
+def test_inference_table():
+    ast, _ = program()(
+        'def double(x):\n'
+        '    return x * 2\n')
+
+    func = ast.body[0]
+    types = Inference(ast)
+    eq_(types.infer(func), infer_function(func))
+    assert types.infer(func) is types.infer(func)
+    eq_(types.resolve(func), {SymbolType('x'): Types.Integer})
+
+def test_dispatch():
+    describe = Dispatch()
+
+    @describe.register(NumericLiteral, StringLiteral)
+    def describe_literal(node):
+        return 'literal %s' % node.value
+
+    class Name(Symbol):
+        pass
+
+    eq_(describe(NumericLiteral('1')), 'literal 1')
+    eq_(describe(StringLiteral('a')), 'literal a')
+
+    extended = describe.extend(default=lambda node: 'other')
+
+    @extended.register(Symbol)
+    def describe_symbol(node):
+        return 'symbol %s' % node.name
+
+    eq_(extended(Name('x')), 'symbol x')
+    eq_(extended(Return(None)), 'other')
+    eq_(extended(NumericLiteral('1')), 'literal 1')
+
+@raises(RuntimeError)
+def test_dispatch_unknown():
+    Dispatch()(Symbol('x'))
+
+def test_node():
+    node = BinaryOperator(Symbol('x'), '+', NumericLiteral('1'))
+
+    eq_(node, BinaryOperator(Symbol('x'), '+', NumericLiteral('1')))
+    assert node != BinaryOperator(Symbol('y'), '+', NumericLiteral('1'))
+    eq_(repr(Symbol(name='x')), "Symbol(name='x')")
+    eq_(pickle.loads(pickle.dumps(node)), node)
+
+    # smaller than the named tuples nodes used to be
+    assert sys.getsizeof(node) < sys.getsizeof(tuple(node._values()))
+
+def test_serialize():
+    text = ('import sys\n'
+            'def f(x, y):\n'
+            '    if x > 1:\n'
+            '        return [1, "a", y]\n'
+            '    return x * 2\n'
+            'sys.log(f(1, 2))\n')
+
+    source = Source(text, lexed=True)
+    ast, _ = program().run(source)
+    spans = source.spans(ast)
+
+    copy = serialize.loads(serialize.dumps(ast))
+    eq_(copy, ast)
+
+    copy, copy_spans = serialize.loads(
+        serialize.dumps(ast, spans), spans=True)
+    eq_(copy, ast)
+    eq_(copy_spans.get(copy.body[1]), spans.get(ast.body[1]))
+    eq_(copy_spans.get(copy.body[1].body.body[0].expression),
+        spans.get(ast.body[1].body.body[0].expression))
+
+    with tempfile.TemporaryFile() as f:
+        serialize.dump(ast, f)
+        f.seek(0)
+        eq_(serialize.load(f), ast)
+
+def test_serialize_deep():
+    ast = Symbol('x')
+    for i in range(10000):
+        ast = BinaryOperator(ast, '+', NumericLiteral(str(i)))
+
+    data = serialize.dumps(ast)
+    eq_(serialize.dumps(serialize.loads(data)), data)
+
+@raises(serialize.FormatError)
+def test_serialize_invalid():
+    serialize.loads(b'not a tree at all')
+
+@raises(serialize.FormatError)
+def test_serialize_truncated():
+    data = serialize.dumps(Block([Symbol('x'), Symbol('y')]))
+    # a buffer cut short, with the word count in its header to match
+    header = list(serialize.unpack(data, serialize.HEADER))
+    header[-1] -= 2
+    truncated = (struct.pack('<%dI' % len(header), *header) +
+                 data[len(header) * 4:-8])
+    serialize.loads(truncated)
+
+
+def test_fold():
+    def binary(a, operator, b):
+        return BinaryOperator(NumericLiteral(a), operator, NumericLiteral(b))
+
+    eq_(fold(BinaryOperator(binary('2', '*', '60'), '*', NumericLiteral('60'))),
+        NumericLiteral('7200'))
+    eq_(fold(binary('1.5', '*', '2.0')), NumericLiteral('3.0'))
+    eq_(fold(binary('6', '/', '3')), NumericLiteral('2'))
+    eq_(fold(BinaryOperator(StringLiteral('"a"'), '+', StringLiteral('"b"'))),
+        StringLiteral('"ab"'))
+
+    # would mean something else in java or cannot be written as a literal
+    for unfolded in [binary('7', '/', '2'), binary('1', '/', '0'),
+                     binary('2', '-', '5'), binary('65536', '*', '65536'),
+                     binary('1.5', '*', '2')]:
+        eq_(fold(unfolded), unfolded)
+
+def test_fold_dead_if():
+    dead = IfStatement(
+        BinaryOperator(NumericLiteral('1'), '==', NumericLiteral('0')),
+        Block([Return(NumericLiteral('1'))]))
+    live = IfStatement(
+        BinaryOperator(Symbol('x'), '==', NumericLiteral('0')),
+        Block([Return(NumericLiteral('1'))]))
+    end = Return(NumericLiteral('2'))
+
+    def function(*body):
+        return Function('f', ['x'], Block(list(body)))
+
+    eq_(fold(function(dead, live, end)), function(live, end))
+    # a function keeps a return to be typed by
+    eq_(fold(function(dead)), function(dead))
+
+    # the program is not typed by its returns
+    log = Invocation(Symbol('sys.log'), [NumericLiteral('2')])
+    eq_(fold(Block([dead, log])), Block([log]))
+    eq_(fold(Block([dead])), Block([]))
+
+    # the call still runs before the condition turns out false
+    call = BinaryOperator(
+        Invocation(Symbol('f'), [NumericLiteral('1')]), '>', NumericLiteral('0'))
+    called = IfStatement(
+        BinaryOperator(call, 'and', dead.expression), dead.body)
+    eq_(fold(Block([called, log])), Block([called, log]))
+    skipped = IfStatement(
+        BinaryOperator(dead.expression, 'and', call), dead.body)
+    eq_(fold(Block([skipped, log])), Block([log]))
+    pure = IfStatement(
+        BinaryOperator(live.expression, 'and', dead.expression), dead.body)
+    eq_(fold(Block([pure, log])), Block([log]))
+
+
+def test_purity():
+    ast, _ = program()(
+        'def fib(n):\n'
+        '    if n < 2:\n'
+        '        return 1\n'
+        '    return fib(n - 1) + fib(n - 2)\n'
+        'def count(n):\n'
+        '    if n == 0:\n'
+        '        return 0\n'
+        '    return count(n - 1)\n'
+        'def say(n):\n'
+        '    sys.log(n)\n'
+        '    return say(n - 1)\n'
+        'def double(x):\n'
+        '    return x * 2\n')
+
+    fib, count, say, double = ast.body
+    types = Inference(ast)
+    eq_(analyze(fib).calls, 2)
+    eq_(analyze(fib).tail_calls, [])
+    eq_(analyze(count).tail_calls, [count.body.body[-1]])
+    assert not analyze(say).pure
+
+    eq_(optimization(fib, types), MEMOIZE)
+    eq_(optimization(count, types), LOOP)
+    eq_(optimization(say, types), None)
+    eq_(optimization(double, types), None)
+
+
+def test_infer_list():
+    integers = ListLiteral([NumericLiteral('1'), NumericLiteral('2')])
+    doubles = ListLiteral([NumericLiteral('1.5')])
+    mixed = ListLiteral([NumericLiteral('1'), NumericLiteral('1.5')])
+    nested = ListLiteral([integers])
+
+    eq_(infer_list(integers), (ListType(Types.Integer), set()))
+    eq_(infer_list(doubles), (ListType(Types.Double), set()))
+    eq_(infer_list(mixed), (Types.List, set()))
+    eq_(infer_list(nested), (Types.List, set()))
+    eq_(infer_list(ListLiteral([])), (Types.List, set()))
+
+    a, b = SymbolType('a'), SymbolType('b')
+    eq_(resolve_types({(a, ListType(Types.Integer)), (a, b)}),
+        {a: ListType(Types.Integer), b: ListType(Types.Integer)})
+    # lists of different elements can still be assigned to each other
+    eq_(resolve_types({(a, ListType(Types.Integer)),
+                       (a, ListType(Types.Double))}),
+        {a: Types.List})
+
+    # a block returning lists of different elements returns a list
+    block = Block([
+        IfStatement(
+            BinaryOperator(Symbol('n'), '<', NumericLiteral('1')),
+            Block([Return(integers)])),
+        Return(doubles)])
+    eq_(Inference(block).infer(block)[0], Types.List)
+
+def test_destination():
+    ast, _ = program()(
+        'def f(n):\n'
+        '    x = [1]\n'
+        '    y = [1]\n'
+        '    y = [1.5]\n'
+        '    return [2]\n'
+        'sys.log([3])\n')
+    x, y, _, result = ast.body[0].body.body
+    types = Inference(ast)
+
+    eq_(types.destination(x.src), ListType(Types.Integer))
+    eq_(types.destination(y.src), Types.List)
+    eq_(types.destination(result.result), ListType(Types.Integer))
+    eq_(types.destination(ast.body[1].args[0]), None)
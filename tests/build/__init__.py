@@ -0,0 +1,206 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from nose.tools import eq_, raises
+
+import matcha
+from matcha.build import ModuleGraph, changed
+
+
+def write_modules(modules):
+    path = tempfile.mkdtemp()
+    for name, imports in modules.items():
+        with open(os.path.join(path, name + '.tea'), 'w') as f:
+            for i in imports:
+                f.write('import %s\n' % i)
+            f.write('def f():\n    return 1\n')
+
+    return path
+
+def test_transitive_imports():
+    path = write_modules({
+        'a': ['b', 'c'],
+        'b': ['c'],
+        'c': []})
+
+    graph = ModuleGraph('js')
+    assert graph.add(['a'], path)
+    eq_([m.name for m in graph.order(['a'])], ['c', 'b', 'a'])
+
+def test_compiled_once():
+    path = write_modules({
+        'a': ['c'],
+        'b': ['c'],
+        'c': []})
+
+    graph = ModuleGraph('js')
+    assert graph.add(['a', 'b'], path)
+    eq_([m.name for m in graph.order(['a', 'b'])], ['c', 'a', 'b'])
+    eq_(len(graph.lookups), 3)
+
+def test_discard():
+    path = write_modules({
+        'a': ['b'],
+        'b': ['c'],
+        'c': []})
+
+    graph = ModuleGraph('js')
+    graph.add(['a'], path)
+    eq_(graph.importers(['c']), {'a', 'b', 'c'})
+
+    with open(os.path.join(path, 'c.tea'), 'a') as f:
+        f.write('import d\n')
+    with open(os.path.join(path, 'd.tea'), 'w') as f:
+        f.write('def g():\n    return 2\n')
+
+    graph.discard(['c'])
+    assert graph.add(['a'], path)
+    eq_([m.name for m in graph.order(['a'])], ['d', 'c', 'b', 'a'])
+
+def test_changed():
+    path = write_modules({'a': []})
+    filename = os.path.join(path, 'a.tea')
+    stamps = {}
+
+    eq_(changed([filename], stamps), [filename])
+    eq_(changed([filename], stamps), [])
+
+    with open(filename, 'a') as f:
+        f.write('\n')
+    os.utime(filename, ns=(0, 0))
+    eq_(changed([filename], stamps), [filename])
+
+    os.utime(filename, ns=(1, 1))
+    eq_(changed([filename], stamps), [])
+
+@raises(RuntimeError)
+def test_cycle():
+    path = write_modules({
+        'a': ['b'],
+        'b': ['a']})
+
+    graph = ModuleGraph('js')
+    graph.add(['a'], path)
+    graph.order(['a'])
+
+def test_streamed_build():
+    import io
+    from matcha.build import build, compile_source, parse
+
+    path = write_modules({'a': []})
+    text = 'import a\nsys.log(a.f())\n'
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        for language in ('js', 'java'):
+            ast, output = compile_source(text, 'Program', language,
+                                         is_main=True)
+            linked = io.StringIO()
+            assert build(linked, ModuleGraph(language), ast, output, path,
+                         language)
+
+            ast, _ = parse(text)
+            streamed = io.StringIO()
+            assert build(streamed, ModuleGraph(language), ast, None, path,
+                         language)
+            eq_(streamed.getvalue(), linked.getvalue())
+    finally:
+        os.chdir(cwd)
+
+def test_source_map():
+    from matcha.build import compile_source
+    from matcha.js import sourcemap
+
+    text = 'def f(x):\n    return x + 1\n\nsys.log(f(1))\n'
+    mappings = []
+    ast, output = compile_source(text, 'Program', 'js', mappings=mappings)
+    lines = output.split('\n')
+    starts = {(m[3], m[4]): lines[m[0]][m[1]:] for m in mappings}
+    assert starts[(0, 0)].startswith('var f = function(x)')
+    assert starts[(3, 0)].startswith('sys.log(')
+    assert starts[(3, 8)].startswith('f(1)')
+
+    eq_(sourcemap.vlq(0), 'A')
+    eq_(sourcemap.vlq(-1), 'D')
+    eq_(sourcemap.vlq(16), 'gB')
+    eq_(sourcemap.encode([(0, 0, 0, 0, 0), (1, 4, 0, 1, 2)]), 'AAAA;IACE')
+
+def test_optimize():
+    from matcha.build import compile_source
+
+    text = ('def count(n):\n'
+            '    if n == 0:\n'
+            '        return 0\n'
+            '    return count(n - 1)\n')
+    _, plain = compile_source(text, 'Program', 'js')
+    _, js = compile_source(text, 'Program', 'js', optimize=True)
+    _, java = compile_source(text, 'Program', 'java', optimize=True)
+    assert 'while' not in plain
+    assert 'while (true) {' in js and 'n = n$; continue;' in js
+    assert 'int n$ = (n - 1);' in java
+
+def test_numeric_arrays():
+    from matcha.build import compile_source
+
+    text = ('def numbers():\n'
+            '    return [1, 2, 3]\n'
+            'def halves():\n'
+            '    return [0.5, 1.5]\n'
+            'def names():\n'
+            '    return ["a", "b"]\n')
+    _, java = compile_source(text, 'Program', 'java')
+    assert 'int[] numbers() { \nreturn new int[]{1,2,3};' in java
+    assert 'double[] halves() { \nreturn new double[]{0.5,1.5};' in java
+    assert 'List names() { \nreturn Arrays.asList("a","b");' in java
+
+    # only where an array is expected
+    text = ('sys.log([[1, 2], [3]])\n'
+            'def joined():\n'
+            '    x = [1]\n'
+            '    x = [1.5]\n'
+            '    return x\n'
+            'def either(n):\n'
+            '    if n < 1:\n'
+            '        return [1, 2]\n'
+            '    return [1.5]\n')
+    _, java = compile_source(text, 'Program', 'java')
+    assert 'new ' not in java
+    assert 'sys.log(Arrays.asList(Arrays.asList(1,2),Arrays.asList(3)))' in java
+    assert 'List joined() { List x;' in java
+    assert 'List either(int n)' in java
+
+def test_memoized_array():
+    from matcha.build import compile_source
+
+    text = ('def f(n):\n'
+            '    if n < 1:\n'
+            '        return [1]\n'
+            '    f(n - 1)\n'
+            '    return [2]\n')
+    _, java = compile_source(text, 'Program', 'java', optimize=True)
+    assert 'HashMap<List<Object>, int[]> f$memo' in java
+    assert 'int[] f$body(int n)' in java
+
+def test_import_budget():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import matcha.build'],
+        cwd=os.path.dirname(os.path.dirname(matcha.__file__)),
+        stderr=subprocess.PIPE, universal_newlines=True)
+
+    cumulative = {}
+    for line in result.stderr.splitlines()[1:]:
+        _, total, name = line.split('|')
+        cumulative[name.strip()] = int(total)
+
+    # backends and worker processes are imported when they are used
+    for name in ('matcha.js', 'matcha.java', 'multiprocessing'):
+        assert name not in cumulative, name
+
+    # how long it takes depends on the machine, the time is only checked
+    # against a budget in microseconds given in MATCHA_IMPORT_BUDGET
+    budget = os.getenv('MATCHA_IMPORT_BUDGET')
+    if budget:
+        assert cumulative['matcha.build'] < int(budget), \
+            cumulative['matcha.build']
@@ -0,0 +1,77 @@
+import os
+import tempfile
+from array import array
+
+from nose.tools import eq_
+
+from matcha.ast import Block, NumericLiteral, Return, Spans
+from matcha.cache import Cache
+
+
+def test_roundtrip():
+    cache = Cache(tempfile.mkdtemp())
+    key = cache.key('return 1', 'Program', 'js')
+    ast = Block([Return(NumericLiteral('1'))])
+    spans = Spans(ast, array('i', [0, 0, 7]), array('i', [8, 8, 8]))
+
+    eq_(cache.get(key), None)
+    cache.put(key, (ast, 'return 1', spans))
+    copy, output, copy_spans = cache.get(key)
+    eq_((copy, output), (ast, 'return 1'))
+    eq_(copy_spans.get(copy.body[0].result), (7, 8))
+
+def test_key():
+    cache = Cache(tempfile.mkdtemp())
+    key = cache.key('x = 1', 'Program', 'js')
+
+    eq_(key, cache.key('x = 1', 'Program', 'js'))
+    assert key != cache.key('x = 2', 'Program', 'js')
+    assert key != cache.key('x = 1', 'Program', 'java')
+    assert key != cache.key('x = 1', 'Other', 'js')
+    assert key != cache.key('x = 1', 'Program', 'js', is_main=True)
+
+def test_evicts_least_recently_used():
+    # room for three entries
+    entry = (Block([]), 'x' * 400, None)
+    cache = Cache(tempfile.mkdtemp(), max_size=1400)
+    keys = [cache.key(str(i), 'Program', 'js') for i in range(3)]
+
+    for i, key in enumerate(keys):
+        cache.put(key, entry)
+        # entries are ordered by modification time
+        os.utime(cache.filename(key), (i, i))
+
+    cache.get(keys[0])
+    cache.put(cache.key('3', 'Program', 'js'), entry)
+
+    eq_(cache.get(keys[1]), None)
+    eq_(cache.get(keys[0])[:2], entry[:2])
+
+def test_entries_removed_concurrently():
+    class Racing(Cache):
+        # another process evicts every entry right after it is read
+        def read(self, f):
+            entry = Cache.read(self, f)
+            os.remove(f.name)
+            return entry
+
+    cache = Racing(tempfile.mkdtemp())
+    key = cache.key('return 1', 'Program', 'js')
+    entry = (Block([Return(NumericLiteral('1'))]), 'return 1', None)
+
+    cache.put(key, entry)
+    eq_(cache.get(key)[:2], entry[:2])
+    eq_(cache.get(key), None)
+
+    scandir = os.scandir
+    def racing_scandir(path):
+        entries = list(scandir(path))
+        for entry in entries:
+            os.remove(entry.path)
+        return entries
+
+    os.scandir = racing_scandir
+    try:
+        cache.evict()
+    finally:
+        os.scandir = scandir
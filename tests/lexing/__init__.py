@@ -0,0 +1,58 @@
+from nose.tools import eq_
+
+from matcha.lexing import (
+    NAME, NUMBER, STRING, NEWLINE, INDENT, DEDENT, ENDMARKER, ERRORTOKEN,
+    keyword_kind, operator_kind, tokenize)
+
+
+def kinds(text):
+    return list(tokenize(text).kinds)
+
+def values(text):
+    tokens = tokenize(text)
+    return [tokens.value(i) for i in range(len(tokens))]
+
+
+def test_simple():
+    eq_(values('x = fib(n-1) >= 2.5'),
+        ['x', '=', 'fib', '(', 'n', '-', '1', ')', '>=', '2.5', '', ''])
+    eq_(kinds('x = "a b"'),
+        [NAME, operator_kind['='], STRING, NEWLINE, ENDMARKER])
+
+def test_offsets_compact():
+    tokens = tokenize('x = 1')
+    eq_((tokens.starts.itemsize, tokens.ends.itemsize), (4, 4))
+
+def test_keywords():
+    eq_(kinds('return define'),
+        [keyword_kind['return'], NAME, NEWLINE, ENDMARKER])
+
+def test_errors():
+    eq_(kinds('{1'), [ERRORTOKEN, NUMBER, NEWLINE, ENDMARKER])
+    eq_(kinds(''), [ENDMARKER])
+
+def test_indentation():
+    tokens = tokenize(
+        'if x:\n'
+        '    if y:\n'
+        '\n'
+        '        y = 0\n'
+        '    x = 1\n'
+        'z = 2')
+
+    blocks = [(kind, start, end) for kind, start, end in tokens
+        if kind in (INDENT, DEDENT)]
+    eq_(blocks, [
+        (INDENT, 6, 10),
+        (INDENT, 17, 25),
+        (DEDENT, 31, 31),
+        (DEDENT, 41, 41)])
+
+def test_dedent_at_end():
+    eq_(kinds('def f():\n    return 1\n')[-4:],
+        [NUMBER, NEWLINE, DEDENT, ENDMARKER])
+
+def test_brackets_continue_lines():
+    eq_(kinds('f(1,\n  2)\n'), [
+        NAME, operator_kind['('], NUMBER, operator_kind[','],
+        NUMBER, operator_kind[')'], NEWLINE, ENDMARKER])
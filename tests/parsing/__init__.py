@@ -3,10 +3,11 @@ from nose.tools import eq_, assert_is_instance
 from matcha.ast import (Invocation, Function, Assignment,
     BinaryOperator, IfStatement, Return, Block, NumericLiteral,
     StringLiteral, Symbol, ListLiteral)
-from matcha.parsing.base import joined, match
+from matcha.parsing.base import Source, joined, match
 from matcha.parsing import (symbol, atom, invocation, function,
     oneof, arguments, assignment, binary_operator,
-    if_statement, return_statement, literal)
+    if_statement, return_statement, literal, expression, statement,
+    block, Grammar)
 
 def full_match(parser, string, node=None):
     if node:
@@ -118,23 +119,52 @@ def test_binary():
 
     eq_(r, '')
     assert_is_instance(node, BinaryOperator)
-    eq_(node.first, Symbol('a'))
+    eq_(node.first, BinaryOperator(
+        Symbol('a'), '+', Symbol('b')))
     eq_(node.operator, '+')
-    eq_(node.second, BinaryOperator(
-        Symbol('b'), '+', Symbol('c')))
+    eq_(node.second, Symbol('c'))
 
     node, r = p('a + b + c + d')
 
     eq_(r, '')
     assert_is_instance(node, BinaryOperator)
-    eq_(node.first, Symbol('a'))
-    eq_(node.operator, '+')
-    eq_(node.second,
-            BinaryOperator(Symbol('b'), '+',
+    eq_(node.first,
+            BinaryOperator(
                 BinaryOperator(
-                    Symbol('c'),
+                    Symbol('a'),
                     '+',
-                    Symbol('d'))))
+                    Symbol('b')),
+                '+', Symbol('c')))
+    eq_(node.operator, '+')
+    eq_(node.second, Symbol('d'))
+
+    no_match(p, 'a')
+
+def test_precedence():
+    p = expression()
+    a, b, c = Symbol('a'), Symbol('b'), Symbol('c')
+
+    eq_(p('a + b * c')[0],
+        BinaryOperator(a, '+', BinaryOperator(b, '*', c)))
+    eq_(p('a * b - c')[0],
+        BinaryOperator(BinaryOperator(a, '*', b), '-', c))
+    eq_(p('a * (b - c)')[0],
+        BinaryOperator(a, '*', BinaryOperator(b, '-', c)))
+    eq_(p('a or b and c')[0],
+        BinaryOperator(a, 'or', BinaryOperator(b, 'and', c)))
+    eq_(p('a + 1 <= b or c >= 2')[0],
+        BinaryOperator(
+            BinaryOperator(BinaryOperator(a, '+', NumericLiteral('1')),
+                '<=', b),
+            'or',
+            BinaryOperator(c, '>=', NumericLiteral('2'))))
+
+def test_long_chain():
+    node, r = expression()(' + '.join(['a'] * 5000))
+
+    eq_(r, '')
+    eq_(node.second, Symbol('a'))
+    eq_(node.first.operator, '+')
 
 class TestFunction():
     def test_simple(self):
@@ -219,3 +249,38 @@ def test_list_literal():
     full_match(p, '[1,2,3]', ListLiteral(
         [NumericLiteral(x) for x in ['1','2','3']]))
 
+def test_packrat():
+    text = 'fibonacci(n-1) + fibonacci(n-2)'
+    source = Source(text, packrat=True, lexed=True)
+
+    r = expression().parse(source, 0)
+    eq_(expression().parse(source, 0), r)
+    eq_(source.hits, 1)
+
+    eq_(expression().run(source), expression()(text))
+    eq_(source.memo, {})
+
+def test_grammar_built_once():
+    assert expression() is expression()
+    assert statement() is statement()
+
+    grammar = Grammar()
+    eq_(set(grammar.rules), set(Grammar().rules))
+    assert grammar.block() is grammar.block()
+    assert grammar.block() is not block()
+
+def test_spans():
+    text = 'def f(x):\n    return x + 12\n'
+    source = Source(text, lexed=True)
+    func, _ = function(0).run(source)
+    result = func.body.body[0].result
+    spans = source.spans(func)
+
+    def text_of(node):
+        start, end = spans.get(node)
+        return text[start:end]
+
+    eq_(text_of(func), text)
+    eq_(text_of(result), 'x + 12')
+    eq_(text_of(result.second), '12')
+    eq_(spans.get(Symbol('x')), None)
@@ -0,0 +1,36 @@
+import io
+import json
+
+from nose.tools import eq_
+
+from matcha import profiling
+from matcha.build import compile_source
+
+
+def test_profile():
+    text = 'def double(x):\n    return x * 2\n'
+    profile = profiling.start()
+    try:
+        compile_source(text, 'Program', 'js')
+    finally:
+        eq_(profiling.stop(), profile)
+
+    for stack in [('compile',), ('compile', 'parse'), ('compile', 'infer'),
+                  ('compile', 'infer', 'resolve'), ('compile', 'generate')]:
+        eq_(profile.phases[stack][0], 1)
+
+    tried, backtracked = profile.rules['function']
+    eq_((tried, backtracked), (1, 0))
+    assert profile.rules['line'][1] >= 1
+
+    out = io.StringIO()
+    profile.dump(out)
+    eq_(json.loads(out.getvalue())['rules']['function'],
+        {'tried': 1, 'backtracked': 0})
+
+    lines = dict(line.rsplit(' ', 1) for line in profile.folded())
+    assert 'compile;parse' in lines
+
+def test_no_profile():
+    eq_(profiling.active, None)
+    assert profiling.phase('compile') is profiling.NOTHING
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from nose.tools import eq_
+
+from matcha import client
+from matcha.build import compile_source
+from matcha.server import run, serve_lines
+
+
+def test_serve_lines():
+    source = 'def f():\n    return 1\n'
+    lines = [
+        json.dumps({'id': 1, 'language': 'js', 'source': source}),
+        '',
+        'not json',
+        json.dumps({'id': 2, 'language': 'js', 'source': 'def'})]
+
+    replies = []
+    with ThreadPoolExecutor(1) as executor:
+        serve_lines(lines, replies.append, executor)
+
+    replies = {r['id']: r for r in map(json.loads, replies)}
+    _, output = compile_source(source, 'Program', 'js', is_main=True)
+    eq_(replies[1]['output'], output)
+    assert 'invalid job' in replies[None]['error']
+    assert 'error' in replies[2]
+
+
+def test_stamps_per_graph():
+    path = tempfile.mkdtemp()
+    module = os.path.join(path, 'm2.tea')
+
+    def write_module(result):
+        with open(module, 'w') as f:
+            f.write('def f():\n    return %d\n' % result)
+
+    def job(language):
+        reply = run({'id': 1, 'language': language, 'cwd': path,
+                     'source': 'import m2\nsys.log(m2.f())\n'})
+        assert 'error' not in reply, reply['error']
+        if language == 'js':
+            return reply['output']
+
+        # java modules are classes of their own, written next to the program
+        with open(os.path.join(path, 'm2.java')) as f:
+            return f.read()
+
+    cwd = os.getcwd()
+    write_module(1)
+    try:
+        assert 'return 1' in job('js')
+        assert 'return 1' in job('java')
+
+        # only the java build sees the change, the js one has to as well
+        write_module(2)
+        os.utime(module, ns=(0, 0))
+        assert 'return 2' in job('java')
+        assert 'return 2' in job('js')
+    finally:
+        os.chdir(cwd)
+
+
+def test_errors_and_environment():
+    lib = tempfile.mkdtemp()
+    with open(os.path.join(lib, 'm3.tea'), 'w') as f:
+        f.write('def f():\n    return 3\n')
+
+    filename = os.path.join(tempfile.mkdtemp(), 'program.tea')
+    def job(text):
+        with open(filename, 'w') as f:
+            f.write(text)
+
+        # a client with its own library, the server has the default
+        saved = os.environ.get('MATCHA_LIB')
+        os.environ['MATCHA_LIB'] = lib
+        try:
+            job = client.compile_job('js', filename)
+        finally:
+            if saved is None:
+                del os.environ['MATCHA_LIB']
+            else:
+                os.environ['MATCHA_LIB'] = saved
+
+        reply = run(job)
+        eq_(os.environ.get('MATCHA_LIB'), saved)
+        return reply
+
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(filename))
+    try:
+        assert 'return 3' in job('import m3\nsys.log(m3.f())\n')['output']
+
+        # the errors logged while compiling come back with the reply
+        error = job('def f(:\n')['error']
+        assert 'syntax error at 1:' in error, error
+        assert 'failed compiling program' in error, error
+    finally:
+        os.chdir(cwd)